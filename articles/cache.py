@@ -0,0 +1,71 @@
+''' Cache of serialized article payloads.
+    Entries of an article are keyed under a per-article generation token.
+    Invalidating an article drops the token, which orphans all of its
+    entries at once; they are culled by the backend TTL / MAX_ENTRIES. '''
+import hashlib
+import threading
+import uuid
+from django.core.cache import caches
+from articles import conf
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    ''' The configured cache or None when caching is disabled. '''
+    alias = conf.get('CACHE')
+    return caches[alias] if alias else None
+
+
+def stats():
+    ''' Hit and miss counters of this process. '''
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _generation(cache, article_id):
+    key = 'articles:%s:gen' % article_id
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(key, generation):  # another process won the race
+            generation = cache.get(key, generation)
+    return generation
+
+
+def _key(cache, article_id, kind, request):
+    variant = hashlib.md5('|'.join((request.get_full_path(),
+                                    request.accepted_media_type)).encode('utf-8')).hexdigest()
+    return 'articles:%s:%s:%s:%s' % (article_id, _generation(cache, article_id), kind, variant)
+
+
+def lookup(article_id, kind, request):
+    ''' (key, cached payload of `kind` for the request or None). A payload
+        built on a miss is stored under that key, so that an invalidation
+        landing while it is built orphans it. '''
+    cache = get_cache()
+    if cache is None:
+        return None, None
+    key = _key(cache, article_id, kind, request)
+    value = cache.get(key)
+    _count('misses' if value is None else 'hits')
+    return key, value
+
+
+def store(key, value):
+    ''' Store a payload under a key from lookup(). '''
+    cache = get_cache()
+    if cache is not None and key is not None:
+        cache.set(key, value)
+
+
+def invalidate(article_id):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete('articles:%s:gen' % article_id)
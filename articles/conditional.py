@@ -0,0 +1,44 @@
+import hashlib
+from functools import wraps
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def validators(*values, request=None):
+    ''' Returns (etag, last_modified) for a representation built from
+        `values`. The ETag also covers the query string and media type,
+        which select different representations of the same rows. '''
+    parts = [str(value) for value in values]
+    if request is not None:
+        parts += [request.get_full_path(), request.accepted_media_type]
+    etag = hashlib.md5('|'.join(parts).encode('utf-8')).hexdigest()
+    dates = [value for value in values if hasattr(value, 'timestamp')]
+    return quote_etag(etag), int(max(dates).timestamp()) if dates else None
+
+
+def conditional(get_validators):
+    ''' ViewSet method decorator for conditional GETs.
+        `get_validators(view, request, **kwargs)` returns (etag, last_modified)
+        or None when there is nothing to compare against, in which case the
+        view runs normally. Matching If-None-Match / If-Modified-Since
+        requests are answered with 304 without running the view. '''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(view, request, *args, **kwargs)
+            found = get_validators(view, request, **kwargs)
+            if found is None:
+                return method(view, request, *args, **kwargs)
+            etag, last_modified = found
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,20 @@
+from django.conf import settings
+
+DEFAULTS = {
+    'SENTENCE_GAPS': False,  # keep gaps in sentence numbers instead of renumbering on delete
+    'PAGE_SIZE': 100,  # default page size of article and sentence lists
+    'MAX_PAGE_SIZE': 1000,  # upper bound for ?page_size=
+    'CACHE': None,  # cache alias for serialized article payloads, None disables caching
+    'SYNC_OVERLAP': 5,  # seconds of changes sent again by the next sync, for late commits
+    'TOMBSTONE_DAYS': 30,  # deletion log retention, older sync cursors are refused
+    'SHARDS': (),  # database aliases articles are sharded over by author, none for default
+    'EVENT_BUFFER': 1000,  # events kept per watched article for Last-Event-ID resumption
+    'EVENT_HEARTBEAT': 15,  # seconds between heartbeats of an idle event stream
+    'EVENT_STREAM_SECONDS': 300,  # event streams end after that, clients reconnect and resume
+    'EVENT_CHANNEL_TTL': 60,  # seconds an article's events are kept once nobody watches it
+}
+
+
+def get(name):
+    ''' Returns an articles app setting, overridable through settings.ARTICLES. '''
+    return getattr(settings, 'ARTICLES', {}).get(name, DEFAULTS[name])
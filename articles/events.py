@@ -0,0 +1,149 @@
+''' In-process publish/subscribe of article events, for the SSE stream.
+    Only watched articles are tracked: publishing to an article nobody
+    subscribed to is a dict lookup. A watched article has a channel with
+    the last ARTICLES['EVENT_BUFFER'] events and a condition its
+    subscribers block on, all of them reading the one buffer, so an idle
+    subscriber costs a waiting thread and nothing per event. Channels are
+    dropped ARTICLES['EVENT_CHANNEL_TTL'] seconds after their last
+    subscriber left.
+    Event ids are a sequence number, unique within the process, prefixed
+    with a token of the process. A subscriber resuming from an id it may
+    have missed events after, because they were evicted from the buffer,
+    happened while nobody watched or in another process, gets a 'reset'
+    event instead: reload the sentences, then follow the stream. '''
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from articles import conf
+
+BOOT = uuid.uuid4().hex[:8]
+
+Event = namedtuple('Event', 'id name data')  # data is JSON text
+
+
+class Channel(object):
+    ''' Events of one article. Guarded by the broker's lock. '''
+
+    def __init__(self, lock, size, horizon):
+        self.condition = threading.Condition(lock)
+        self.events = deque(maxlen=size)  # (sequence number, Event)
+        self.horizon = horizon  # events up to this number may be missing
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self.closed = False
+
+
+class Broker(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}  # article id (str) -> Channel
+        self.sequence = 0
+
+    def watched(self, article_id):
+        return str(article_id) in self.channels
+
+    def publish(self, article_id, name, data):
+        ''' Send an event to the subscribers of an article, if any. '''
+        with self.lock:
+            channel = self.channels.get(str(article_id))
+            if channel is None:
+                return
+            self.sequence += 1
+            if len(channel.events) == channel.events.maxlen:
+                channel.horizon = channel.events[0][0]
+            channel.events.append((self.sequence, Event('%s-%d' % (BOOT, self.sequence),
+                                                        name, data)))
+            channel.condition.notify_all()
+
+    def close(self, article_id):
+        ''' End the streams of an article, once they sent what is buffered. '''
+        with self.lock:
+            channel = self.channels.pop(str(article_id), None)
+            if channel is not None:
+                channel.closed = True
+                channel.condition.notify_all()
+
+    def subscribe(self, article_id, last_event_id=None):
+        ''' Subscription to an article's events after `last_event_id`,
+            new ones only without it. Events are buffered from now on. '''
+        with self.lock:
+            self.sweep()
+            channel = self.channels.get(str(article_id))
+            if channel is None:
+                self.sequence += 1  # earlier ids may have missed events
+                channel = self.channels[str(article_id)] = Channel(
+                    self.lock, conf.get('EVENT_BUFFER'), self.sequence)
+            channel.idle_since = time.monotonic()  # kept until iterated
+            position = self.sequence
+            if last_event_id is not None:
+                boot, _, number = last_event_id.partition('-')
+                position = int(number) if boot == BOOT and number.isdigit() else -1
+                if position > self.sequence:
+                    position = -1
+        return Subscription(self, channel, position)
+
+    def attach(self, channel):
+        with self.lock:
+            channel.subscribers += 1
+
+    def detach(self, channel):
+        with self.lock:
+            channel.subscribers -= 1
+            channel.idle_since = time.monotonic()
+
+    def sweep(self):
+        ''' Drop the channels nobody subscribed to for a while. '''
+        expired = time.monotonic() - conf.get('EVENT_CHANNEL_TTL')
+        for article_id, channel in list(self.channels.items()):
+            if not channel.subscribers and channel.idle_since < expired:
+                del self.channels[article_id]
+
+
+class Subscription(object):
+    ''' Iterates over events as they are published, None on heartbeats
+        every ARTICLES['EVENT_HEARTBEAT'] seconds without any, and ends
+        after ARTICLES['EVENT_STREAM_SECONDS'], to be resumed, or when the
+        article is deleted. '''
+
+    def __init__(self, broker, channel, position):
+        self.broker = broker
+        self.channel = channel
+        self.position = position
+
+    def __iter__(self):
+        channel, heartbeat = self.channel, conf.get('EVENT_HEARTBEAT')
+        deadline = time.monotonic() + conf.get('EVENT_STREAM_SECONDS')
+        self.broker.attach(channel)
+        try:
+            while True:
+                timeout = min(heartbeat, deadline - time.monotonic())
+                if timeout <= 0:
+                    return
+                with channel.condition:
+                    if not channel.closed and self.position >= channel.horizon and \
+                            not (channel.events and channel.events[-1][0] > self.position):
+                        channel.condition.wait(timeout)
+                    if self.position < channel.horizon:
+                        events = [Event(None, 'reset', '{}')]
+                        self.position = self.broker.sequence
+                    else:
+                        events = [event for number, event in channel.events
+                                  if number > self.position]
+                        if events:
+                            self.position = channel.events[-1][0]
+                    closed = channel.closed
+                for event in events or [None]:
+                    yield event
+                if closed:
+                    return
+        finally:
+            self.broker.detach(channel)
+
+
+broker = Broker()
+watched = broker.watched
+publish = broker.publish
+close = broker.close
+subscribe = broker.subscribe
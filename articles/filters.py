@@ -0,0 +1,36 @@
+import datetime
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class StatisticsFilter(BaseFilterBackend):
+    ''' Filters articles on their denormalized statistics, e.g.
+        ?sentence_count__gte=10&last_sentence_at__lt=2018-01-01T00:00:00Z.
+        Plain column comparisons, no joins or aggregates. '''
+    fields = ('sentence_count', 'word_count', 'last_sentence_at')
+    lookups = ('', '__gt', '__gte', '__lt', '__lte')
+
+    def filter_queryset(self, request, queryset, view):
+        conditions, errors = {}, {}
+        for field in self.fields:
+            model_field = queryset.model._meta.get_field(field)
+            for lookup in self.lookups:
+                value = request.query_params.get(field + lookup)
+                if value is None:
+                    continue
+                try:
+                    value = model_field.to_python(value)
+                except DjangoValidationError as e:
+                    errors[field + lookup] = e.messages
+                    continue
+                if value is None:
+                    errors[field + lookup] = ['A value is required.']
+                    continue
+                if isinstance(value, datetime.datetime) and timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                conditions[field + lookup] = value
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**conditions)
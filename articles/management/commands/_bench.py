@@ -0,0 +1,49 @@
+''' Helpers shared by the benchmark management commands. '''
+import json
+import time
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def test_database():
+    ''' Run the enclosed block against a throwaway test database. '''
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                  serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, p):
+    ''' Nearest-rank percentile of a list of samples. '''
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    ''' Latency summary in milliseconds. '''
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def timed(func, *args, **kwargs):
+    ''' Returns (elapsed seconds, result) of a call. '''
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def dump(stdout, report):
+    stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,162 @@
+import logging
+import random
+import threading
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_jwt.settings import api_settings as jwt_settings
+from articles.models import Article, Sentence, count_words
+from ._bench import test_database, summarize, dump
+
+PASSWORD = 'bench-password'
+
+
+def article_url(article):
+    return '/articles/%s/' % article.uuid
+
+
+def sentence_url(article, num):
+    return '/articles/%s/sentences/%d/' % (article.uuid, num)
+
+
+# route name -> callable(client, article, i) issuing one request
+ROUTES = {
+    'auth': lambda c, a, i: c.post('/auth/', {'username':a.author.username,
+                                              'password':PASSWORD}),
+    'article_list': lambda c, a, i: c.get('/articles/'),
+    'article_detail': lambda c, a, i: c.get(article_url(a)),
+    'sentence_list': lambda c, a, i: c.get(article_url(a) + 'sentences/'),
+    'sentence_detail': lambda c, a, i: c.get(sentence_url(a, 1 + i % 10)),
+    'sentence_append': lambda c, a, i: c.post(article_url(a) + 'sentences/',
+                                              {'text':'appended sentence'}),
+    'sentence_update': lambda c, a, i: c.put(sentence_url(a, 1 + i % 10),
+                                             {'text':'updated sentence %d' % i}),
+    'sentence_delete': lambda c, a, i: c.delete(sentence_url(a, 1)),
+}
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database and load test every API route, '
+            'reporting latency percentiles, requests per second and queries per request as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--articles', type=int, default=5, help='articles per user')
+        parser.add_argument('--sentences', type=int, default=200, help='sentences per article')
+        parser.add_argument('--concurrency', type=int, default=4, help='client threads')
+        parser.add_argument('--requests', type=int, default=200, help='requests per route')
+        parser.add_argument('--routes', default=','.join(ROUTES),
+                            help='comma separated subset of: %s' % ', '.join(ROUTES))
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def handle(self, *args, **options):
+        routes = options['routes'].split(',')
+        unknown = set(routes) - set(ROUTES)
+        if unknown:
+            raise CommandError('Unknown routes: %s' % ', '.join(sorted(unknown)))
+        if options['sentences'] < 10:
+            raise CommandError('--sentences must be at least 10')
+        random.seed(options['seed'])
+
+        report = {'dataset': {key: options[key] for key in ('users', 'articles', 'sentences')},
+                  'concurrency': options['concurrency'], 'routes': {}}
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)  # failures are counted in the report
+        try:
+            with test_database():
+                articles = self.seed(options['users'], options['articles'], options['sentences'])
+                for route in routes:
+                    report['routes'][route] = self.run(ROUTES[route], articles,
+                                                       options['concurrency'], options['requests'])
+        finally:
+            request_logger.setLevel(level)
+        dump(self.stdout, report)
+
+    def seed(self, users, articles, sentences):
+        ''' Create the dataset with batched inserts, returns the articles.
+            Batched inserts skip the statistics upkeep, they are set here. '''
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([User(username='bench%d' % i, password=password)
+                                  for i in range(users)])
+        authors = list(User.objects.filter(username__startswith='bench'))
+        Article.objects.bulk_create([Article(title='Article %d' % i, author=author,
+                                             last_num=sentences)
+                                     for author in authors for i in range(articles)])
+        created = list(Article.objects.select_related('author'))
+        texts = ['Sentence number %d of the article.' % num for num in range(1, sentences + 1)]
+        words = sum(map(count_words, texts))
+        for article in created:
+            rows = Sentence.objects.bulk_create([
+                Sentence(article=article, author=article.author, num=num, text=text)
+                for num, text in enumerate(texts, 1)])
+            article.sentence_count, article.word_count = sentences, words
+            article.last_sentence_at = max(row.pub_date for row in rows)
+            Article.objects.filter(pk=article.pk).update(
+                sentence_count=sentences, word_count=words,
+                last_sentence_at=article.last_sentence_at)
+        random.shuffle(created)
+        return created
+
+    def run(self, request, articles, concurrency, requests):
+        ''' Issue `requests` requests from `concurrency` threads. Each thread
+            works on its own slice of articles, so writes never collide. '''
+        latencies, queries, errors = [], [], []
+        lock = threading.Lock()
+
+        def worker(index):
+            owned = articles[index::concurrency] or articles
+            clients = {}
+            count = [0]
+
+            def counter(execute, sql, params, many, context):
+                count[0] += 1
+                return execute(sql, params, many, context)
+
+            mine, my_queries, my_errors = [], [], []
+            try:
+                with connection.execute_wrapper(counter):
+                    for i in range(index, requests, concurrency):
+                        article = owned[(i // concurrency) % len(owned)]
+                        client = clients.get(article.author_id)
+                        if client is None:
+                            client = clients[article.author_id] = self.client(article.author)
+                        count[0] = 0
+                        start = time.perf_counter()
+                        try:
+                            failed = request(client, article, i).status_code >= 400
+                        except Exception:  # the test client re-raises view errors
+                            failed = True
+                        mine.append(time.perf_counter() - start)
+                        my_queries.append(count[0])
+                        if failed:
+                            my_errors.append(i)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(mine)
+                queries.extend(my_queries)
+                errors.extend(my_errors)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        result = summarize(latencies)
+        result.update(requests_per_second=round(len(latencies) / elapsed, 1),
+                      queries_per_request=round(sum(queries) / float(len(queries)), 2),
+                      errors=len(errors))
+        return result
+
+    def client(self, user):
+        client = APIClient()
+        payload = jwt_settings.JWT_PAYLOAD_HANDLER(user)
+        client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_settings.JWT_ENCODE_HANDLER(payload))
+        return client
@@ -0,0 +1,49 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from config.authentication import CachedJSONWebTokenAuthentication, token_cache
+from articles.models import Article
+from articles.views import ArticleViewSet
+from ._bench import test_database, dump
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second of JWT authentication with and without the token cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='requests per authentication class')
+
+    def handle(self, *args, **options):
+        report = {}
+        original = ArticleViewSet.authentication_classes
+        with test_database():
+            user = User.objects.create_user(username='bench', password='bench')
+            Article.objects.create(title='bench', author=user)
+            client = APIClient()
+            token = client.post('/auth/', {'username':'bench', 'password':'bench'}).data['token']
+            client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+            try:
+                for auth in (JSONWebTokenAuthentication, CachedJSONWebTokenAuthentication):
+                    ArticleViewSet.authentication_classes = (auth,)
+                    token_cache.clear()
+                    report[auth.__name__] = self.run(client, options['requests'])
+            finally:
+                ArticleViewSet.authentication_classes = original
+        dump(self.stdout, report)
+
+    def run(self, client, requests):
+        client.get('/articles/')  # warm up
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get('/articles/')
+            elapsed = time.perf_counter() - start
+        return {
+            'requests_per_second': round(requests / elapsed, 1),
+            'queries_per_request': round(len(queries) / requests, 2),
+        }
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from articles.models import Article
+from ._bench import test_database, summarize, timed, dump
+
+
+class Command(BaseCommand):
+    help = 'Measure sentence delete latency against article length.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', default='100,1000,10000',
+                            help='comma separated article lengths (sentences)')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='deletes per article length')
+
+    def handle(self, *args, **options):
+        lengths = [int(n) for n in options['lengths'].split(',')]
+        report = {}
+        with test_database():
+            user = User.objects.create_user(username='bench', password='bench')
+            for mode, gaps in (('dense', False), ('gaps', True)):
+                report[mode] = {}
+                with override_settings(ARTICLES={'SENTENCE_GAPS': gaps}):
+                    for length in lengths:
+                        report[mode][length] = self.run(user, length, options['repeat'])
+        dump(self.stdout, report)
+
+    def run(self, user, length, repeat):
+        ''' Delete the first sentence of an article `repeat` times. '''
+        article = Article.objects.create(title='bench %d' % length, author=user)
+        article.append_sentences(['sentence'] * length, author=user)
+        samples, queries = [], 0
+        for _ in range(repeat):
+            first = article.sentences.first()
+            with CaptureQueriesContext(connection) as captured:
+                elapsed, _ = timed(article.delete_sentence, first)
+            samples.append(elapsed)
+            queries = len(captured)
+            article.append_sentences(['sentence'], author=user)  # keep the length
+        return dict(summarize(samples), queries=queries)
@@ -0,0 +1,59 @@
+import datetime
+import io
+import uuid
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework import parsers, renderers
+from articles.models import Article, Sentence
+from articles.serializers import SentenceSerializer
+from config import parsers as fast_parsers, renderers as fast_renderers
+from ._bench import summarize, timed, dump
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON rendering and parsing of large sentence lists.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sentences', type=int, default=10000, help='sentences per list')
+        parser.add_argument('--repeat', type=int, default=20, help='runs per encoder')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        article, author_id = Article(uuid=uuid.uuid4()), 1
+        sentences = [Sentence(uuid=uuid.uuid4(), article=article, author_id=author_id,
+                              num=i, text='Sentence number %d, naïve café ☕.' % i,
+                              pub_date=now, mod_date=now + datetime.timedelta(microseconds=i))
+                     for i in range(1, options['sentences'] + 1)]
+        payloads = {
+            # what the sentence list renders: strings from the serializer fields
+            'serialized': SentenceSerializer(sentences, many=True).data,
+            # UUID and datetime objects left to the encoder, as values() rows are
+            'raw': [{'id': s.uuid, 'article': article.uuid, 'num': s.num, 'text': s.text,
+                     'pub_date': s.pub_date, 'mod_date': s.mod_date} for s in sentences],
+        }
+        encoders = {'rest_framework': renderers.JSONRenderer().render,
+                    'stdlib': fast_renderers.dumps_stdlib}
+        decoders = {'rest_framework': parsers.JSONParser().parse,
+                    'stdlib': lambda stream: fast_parsers.loads_stdlib(stream.read())}
+        if fast_renderers.orjson is not None:
+            encoders['orjson'] = fast_renderers.dumps_orjson
+            decoders['orjson'] = lambda stream: fast_parsers.loads_orjson(stream.read())
+
+        report = {}
+        for name, data in payloads.items():
+            expected = renderers.JSONRenderer().render(data)
+            report['render_' + name] = {}
+            for encoder, render in encoders.items():
+                samples = []
+                for _ in range(options['repeat']):
+                    elapsed, body = timed(render, data)
+                    samples.append(elapsed)
+                report['render_' + name][encoder] = dict(summarize(samples),
+                                                         identical=body == expected)
+        body = renderers.JSONRenderer().render(payloads['serialized'])
+        report['parse'] = {}
+        for decoder, parse in decoders.items():
+            samples = [timed(parse, io.BytesIO(body))[0] for _ in range(options['repeat'])]
+            report['parse'][decoder] = summarize(samples)
+        report['bytes'] = len(body)
+        dump(self.stdout, report)
@@ -0,0 +1,150 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+from articles.models import Article, Sentence
+from config import sqlite
+from .convert_int_pks import UUID_SCHEMA
+from ._bench import summarize, timed, dump
+
+TABLES = ('articles_article', 'articles_sentence')
+
+# lookup -> SQL by layout, one public article id (and a number) as parameters
+LOOKUPS = {
+    'article': {
+        'uuid': 'SELECT id, title FROM articles_article WHERE id = %s',
+        'integer': 'SELECT uuid, title FROM articles_article WHERE uuid = %s',
+    },
+    'sentence': {
+        'uuid': 'SELECT id, text FROM articles_sentence WHERE article_id = %s AND num = %s',
+        'integer': 'SELECT s.uuid, s.text FROM articles_sentence s '
+                   'JOIN articles_article a ON a.id = s.article_id WHERE a.uuid = %s AND s.num = %s',
+    },
+    'sentence_page': {
+        'uuid': 'SELECT id, num, text FROM articles_sentence WHERE article_id = %s '
+                'ORDER BY num LIMIT 100',
+        'integer': 'SELECT s.uuid, s.num, s.text FROM articles_sentence s '
+                   'JOIN articles_article a ON a.id = s.article_id WHERE a.uuid = %s '
+                   'ORDER BY s.num LIMIT 100',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Compare UUID and integer primary keys: table and index sizes, insert rate '
+            'and lookup latency by public id, and the time convert_int_pks takes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--sentences', type=int, default=100, help='sentences per article')
+        parser.add_argument('--lookups', type=int, default=2000, help='lookups of each kind')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench_pks')
+        rand = random.Random(0)
+        articles = [uuid.UUID(int=rand.getrandbits(128), version=4)
+                    for _ in range(options['articles'])]
+        report = {}
+        try:
+            for layout in ('uuid', 'integer'):
+                alias = 'bench_pks_%s' % layout
+                connections.databases[alias] = sqlite.database(
+                    os.path.join(directory, '%s.sqlite3' % layout))
+                self.create(alias, layout)
+                elapsed, rows = timed(self.populate, alias, layout, articles, options['sentences'])
+                report[layout] = {'insert': {'rows': rows, 'seconds': round(elapsed, 3),
+                                             'rows_per_second': round(rows / elapsed)},
+                                  'size_kib': self.sizes(alias),
+                                  'lookup': self.lookups(alias, layout, articles, options)}
+            alias = 'bench_pks_uuid'
+            elapsed, _ = timed(call_command, 'convert_int_pks', database=[alias],
+                               stdout=open(os.devnull, 'w'))
+            report['converted'] = {'seconds': round(elapsed, 3), 'size_kib': self.sizes(alias)}
+        finally:
+            for layout in ('uuid', 'integer'):
+                alias = 'bench_pks_%s' % layout
+                if alias in connections.databases:
+                    connections[alias].close()
+                    del connections.databases[alias]
+            shutil.rmtree(directory)
+        dump(self.stdout, report)
+
+    def create(self, alias, layout):
+        ''' The tables and their indexes, without the search index. '''
+        if layout == 'uuid':
+            with connections[alias].cursor() as cursor:
+                for statement in UUID_SCHEMA:
+                    cursor.execute(statement)
+        else:
+            with connections[alias].schema_editor() as editor:
+                editor.create_model(Article)
+                editor.create_model(Sentence)
+
+    def populate(self, alias, layout, articles, sentences):
+        ''' Create the articles, then append their sentences round by
+            round, one sentence to every article per transaction, as
+            concurrent authors would. Returns the number of rows. '''
+        now = '2018-01-01 00:00:00'
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            key = 'id' if layout == 'uuid' else 'uuid'
+            cursor.executemany(
+                'INSERT INTO articles_article (%s, title, pub_date, mod_date, author_id, last_num, '
+                'sentence_count, word_count) VALUES (%%s, %%s, %%s, %%s, 1, %%s, %%s, 0)' % key,
+                [(article.hex, 'Article %d' % i, now, now, sentences, sentences)
+                 for i, article in enumerate(articles)])
+            if layout == 'uuid':
+                parents = [article.hex for article in articles]
+            else:
+                cursor.execute('SELECT uuid, id FROM articles_article')
+                pks = dict(cursor.fetchall())
+                parents = [pks[article.hex] for article in articles]
+        rand = random.Random(1)
+        columns = ('id' if layout == 'uuid' else 'uuid', 'article_id', 'num', 'text', 'pub_date',
+                   'mod_date', 'author_id')
+        sql = 'INSERT INTO articles_sentence (%s) VALUES (%s)' % (
+            ', '.join(columns), ', '.join(['%s'] * len(columns)))
+        for num in range(1, sentences + 1):
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                cursor.executemany(sql, [
+                    (uuid.UUID(int=rand.getrandbits(128), version=4).hex, parent, num,
+                     'Sentence number %d of the article.' % num, now, now, 1)
+                    for parent in parents])
+        return len(articles) * (sentences + 1)
+
+    def sizes(self, alias):
+        ''' KiB used by each table and index of the articles tables. '''
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE tbl_name IN (%s, %s)",
+                               list(TABLES))
+                names = [name for name, in cursor.fetchall()]
+                cursor.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+                sizes = {name: size // 1024 for name, size in cursor.fetchall() if name in names}
+        except DatabaseError:  # SQLite built without the dbstat table
+            return None
+        sizes['tables'] = sum(size for name, size in sizes.items() if name in TABLES)
+        sizes['indexes'] = sum(size for name, size in sizes.items()
+                               if name not in TABLES and name != 'tables')
+        return sizes
+
+    def lookups(self, alias, layout, articles, options):
+        ''' Latency of lookups by public id, on random articles. '''
+        rand = random.Random(2)
+        report = {}
+        with connections[alias].cursor() as cursor:
+            for name, queries in sorted(LOOKUPS.items()):
+                sql, samples = queries[layout], []
+                for _ in range(options['lookups']):
+                    params = [rand.choice(articles).hex, rand.randint(1, options['sentences'])]
+                    params = params[:sql.count('%s')]
+                    start = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    samples.append(time.perf_counter() - start)
+                report[name] = summarize(samples)
+        return report
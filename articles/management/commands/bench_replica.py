@@ -0,0 +1,109 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+from django.test.utils import override_settings
+from articles.models import Article, Sentence
+from config import routers
+from ._bench import test_database, summarize, timed, dump
+
+ALIAS = 'bench_replica'
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed read/write throughput with reads on the primary and on a replica.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='reader threads')
+        parser.add_argument('--writers', type=int, default=2, help='writer threads')
+        parser.add_argument('--duration', type=float, default=5.0, help='seconds per mode')
+        parser.add_argument('--articles', type=int, default=100)
+        parser.add_argument('--sentences', type=int, default=100, help='sentences per article')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench_replica')
+        report = {}
+        try:
+            with test_database():
+                user = User.objects.create_user(username='bench', password='bench')
+                articles = [Article.objects.create(title='bench %d' % i, author=user)
+                            for i in range(options['articles'])]
+                for article in articles:
+                    article.append_sentences(['sentence %d' % n for n in range(options['sentences'])],
+                                             author=user)
+                connections.databases[ALIAS] = dict(connection.settings_dict,
+                                                    NAME=self.copy(directory))
+                for mode, aliases in (('primary', []), ('replica', [ALIAS])):
+                    with override_settings(REPLICAS={'ALIASES': aliases}):
+                        report[mode] = self.run(articles, options)
+                connections[ALIAS].close()
+                connection.close()
+        finally:
+            shutil.rmtree(directory)
+        dump(self.stdout, report)
+
+    def copy(self, directory):
+        ''' Snapshot the primary into a replica stand-in file. '''
+        if connection.settings_dict['ENGINE'] == 'config.sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        name = os.path.join(directory, 'replica.sqlite3')
+        shutil.copyfile(connection.settings_dict['NAME'], name)
+        return name
+
+    def read(self, article):
+        ''' A page of sentences, as the sentence list does. '''
+        with routers.reading_from_replica():
+            return list(Sentence.objects.filter(article=article).order_by('num')
+                        .values_list('num', 'text')[:100])
+
+    def write(self, article):
+        article.append_sentences(['appended'], author=article.author)
+
+    def run(self, articles, options):
+        ''' Run readers and writers for the duration, each operation being
+            one request: connections are released the way request_finished
+            does. '''
+        deadline = time.perf_counter() + options['duration']
+        results = {'read': ([], []), 'write': ([], [])}
+        lock = threading.Lock()
+
+        def client(kind, operation):
+            samples, errors = [], 0
+            rand = random.Random()
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        elapsed, _ = timed(operation, rand.choice(articles))
+                        samples.append(elapsed)
+                    except DatabaseError:
+                        errors += 1
+                    for conn in connections.all():
+                        conn.close_if_unusable_or_obsolete()
+            finally:
+                for conn in connections.all():
+                    conn.close()
+            with lock:
+                results[kind][0].extend(samples)
+                results[kind][1].append(errors)
+
+        threads = ([threading.Thread(target=client, args=('read', self.read))
+                    for _ in range(options['readers'])] +
+                   [threading.Thread(target=client, args=('write', self.write))
+                    for _ in range(options['writers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = {}
+        for kind, (samples, errors) in results.items():
+            report[kind] = dict(summarize(samples) if samples else {'count': 0},
+                                errors=sum(errors),
+                                per_second=round(len(samples) / options['duration'], 1))
+        return report
@@ -0,0 +1,103 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+from config import sqlite
+from ._bench import summarize, timed, dump
+
+
+class Command(BaseCommand):
+    help = 'Compare SQLite connection profiles under concurrent readers and writers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default=','.join(sqlite.PROFILES),
+                            help='comma separated profiles to compare')
+        parser.add_argument('--readers', type=int, default=8, help='reader threads')
+        parser.add_argument('--writers', type=int, default=2, help='writer threads')
+        parser.add_argument('--duration', type=float, default=5.0, help='seconds per profile')
+        parser.add_argument('--articles', type=int, default=100)
+        parser.add_argument('--sentences', type=int, default=100, help='sentences per article')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench_sqlite')
+        report = {}
+        try:
+            for profile in options['profiles'].split(','):
+                alias = 'bench_%s' % profile
+                connections.databases[alias] = sqlite.database(
+                    os.path.join(directory, '%s.sqlite3' % profile), profile)
+                self.populate(alias, options['articles'], options['sentences'])
+                report[profile] = self.run(alias, options)
+                connections[alias].close()
+        finally:
+            shutil.rmtree(directory)
+        dump(self.stdout, report)
+
+    def populate(self, alias, articles, sentences):
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE sentence (id INTEGER PRIMARY KEY, '
+                           'article INTEGER, num INTEGER, text TEXT)')
+            cursor.execute('CREATE UNIQUE INDEX sentence_article_num ON sentence (article, num)')
+            cursor.executemany('INSERT INTO sentence (article, num, text) VALUES (%s, %s, %s)',
+                               [(a, n, 'sentence %d' % n) for a in range(articles)
+                                for n in range(1, sentences + 1)])
+
+    def read(self, alias, article):
+        ''' A page of sentences, as the sentence list does. '''
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT num, text FROM sentence WHERE article = %s '
+                           'ORDER BY num LIMIT 100', [article])
+            return cursor.fetchall()
+
+    def write(self, alias, article):
+        ''' Read the last number and append after it, as an append does. '''
+        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+            cursor.execute('SELECT MAX(num) FROM sentence WHERE article = %s', [article])
+            last = cursor.fetchone()[0] or 0
+            cursor.execute('INSERT INTO sentence (article, num, text) VALUES (%s, %s, %s)',
+                           [article, last + 1, 'appended'])
+
+    def run(self, alias, options):
+        ''' Run readers and writers for the duration, each operation being
+            one request: the connection is released the way request_finished
+            does, so only persistent connections survive between requests. '''
+        deadline = time.perf_counter() + options['duration']
+        results = {'read': ([], []), 'write': ([], [])}
+        lock = threading.Lock()
+
+        def client(kind, operation):
+            samples, errors = [], 0
+            rand = random.Random()
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        elapsed, _ = timed(operation, alias, rand.randrange(options['articles']))
+                        samples.append(elapsed)
+                    except DatabaseError:
+                        errors += 1
+                    connections[alias].close_if_unusable_or_obsolete()
+            finally:
+                connections[alias].close()
+            with lock:
+                results[kind][0].extend(samples)
+                results[kind][1].append(errors)
+
+        threads = ([threading.Thread(target=client, args=('read', self.read))
+                    for _ in range(options['readers'])] +
+                   [threading.Thread(target=client, args=('write', self.write))
+                    for _ in range(options['writers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        report = {}
+        for kind, (samples, errors) in results.items():
+            report[kind] = dict(summarize(samples) if samples else {'count': 0},
+                                errors=sum(errors),
+                                per_second=round(len(samples) / options['duration'], 1))
+        return report
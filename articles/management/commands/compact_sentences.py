@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import router
+from django.db.models import Count, Max
+from articles import shards
+from articles.models import Article
+
+
+class Command(BaseCommand):
+    help = ('Renumber the sentences of articles with gaps in their numbers, left by deletes '
+            'with ARTICLES["SENTENCE_GAPS"] on. Run once after switching it off.')
+
+    def handle(self, *args, **options):
+        checked, compacted = 0, 0
+        for using in shards.aliases() or [router.db_for_write(Article)]:
+            rows = (Article.objects.using(using).order_by('pk')
+                    .annotate(last=Max('sentences__num'), total=Count('sentences'))
+                    .values_list('pk', 'last_num', 'last', 'total'))
+            gapped = []
+            for pk, last_num, last, total in rows.iterator(chunk_size=2000):
+                checked += 1
+                if not last_num == (last or 0) == total:
+                    gapped.append(pk)
+            for article in Article.objects.using(using).filter(pk__in=gapped):
+                article.compact_sentences()
+            compacted += len(gapped)
+        self.stdout.write('%d articles checked, %d compacted' % (checked, compacted))
@@ -0,0 +1,161 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from articles import search, shards
+from articles.models import Article, Sentence, Tombstone
+from . import rebuild_article_stats
+
+# The first layout, as syncdb created it: UUID primary keys, no statistics.
+BASELINE_SCHEMA = [
+    'CREATE TABLE "articles_article" ("id" char(32) NOT NULL PRIMARY KEY, '
+    '"title" varchar(60) NOT NULL, "pub_date" datetime NOT NULL, "mod_date" datetime NOT NULL, '
+    '"author_id" integer NOT NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED)',
+    'CREATE TABLE "articles_sentence" ("id" char(32) NOT NULL PRIMARY KEY, '
+    '"article_id" char(32) NOT NULL REFERENCES "articles_article" ("id") '
+    'DEFERRABLE INITIALLY DEFERRED, "num" integer NOT NULL, "text" text NOT NULL, '
+    '"pub_date" datetime NOT NULL, "mod_date" datetime NOT NULL, "author_id" integer NOT NULL '
+    'REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED)',
+    'CREATE INDEX "articles_article_author_id_059aea7d" ON "articles_article" ("author_id")',
+    'CREATE UNIQUE INDEX "articles_sentence_article_id_num_48db7e93_uniq" ON "articles_sentence" '
+    '("article_id", "num")',
+    'CREATE INDEX "articles_sentence_article_id_39309c4f" ON "articles_sentence" ("article_id")',
+    'CREATE INDEX "articles_sentence_author_id_5b108449" ON "articles_sentence" ("author_id")',
+]
+
+# The last layout with UUID primary keys, as syncdb created it.
+UUID_SCHEMA = [
+    'CREATE TABLE "articles_article" ("id" char(32) NOT NULL PRIMARY KEY, '
+    '"title" varchar(60) NOT NULL, "pub_date" datetime NOT NULL, "mod_date" datetime NOT NULL, '
+    '"author_id" integer NOT NULL, "last_num" integer NOT NULL, '
+    '"sentence_count" integer NOT NULL, "word_count" integer NOT NULL, '
+    '"last_sentence_at" datetime NULL)',
+    'CREATE TABLE "articles_sentence" ("id" char(32) NOT NULL PRIMARY KEY, '
+    '"article_id" char(32) NOT NULL REFERENCES "articles_article" ("id") '
+    'DEFERRABLE INITIALLY DEFERRED, "num" integer NOT NULL, "text" text NOT NULL, '
+    '"pub_date" datetime NOT NULL, "mod_date" datetime NOT NULL, "author_id" integer NOT NULL)',
+    'CREATE INDEX "articles_article_author_id_059aea7d" ON "articles_article" ("author_id")',
+    'CREATE INDEX "articles_ar_author__2c9303_idx" ON "articles_article" '
+    '("author_id", "pub_date", "id")',
+    'CREATE INDEX "articles_ar_author__3573a3_idx" ON "articles_article" '
+    '("author_id", "sentence_count", "id")',
+    'CREATE INDEX "articles_ar_author__2b22a8_idx" ON "articles_article" '
+    '("author_id", "word_count", "id")',
+    'CREATE INDEX "articles_ar_author__39fe4d_idx" ON "articles_article" '
+    '("author_id", "last_sentence_at", "id")',
+    'CREATE INDEX "articles_ar_author__c1d9cb_idx" ON "articles_article" '
+    '("author_id", "mod_date", "id")',
+    'CREATE UNIQUE INDEX "articles_sentence_article_id_num_48db7e93_uniq" ON "articles_sentence" '
+    '("article_id", "num")',
+    'CREATE INDEX "articles_sentence_article_id_39309c4f" ON "articles_sentence" ("article_id")',
+    'CREATE INDEX "articles_sentence_author_id_5b108449" ON "articles_sentence" ("author_id")',
+    'CREATE INDEX "articles_se_author__39314f_idx" ON "articles_sentence" '
+    '("author_id", "mod_date", "id")',
+]
+
+
+class Command(BaseCommand):
+    help = ('Convert the articles and sentences tables from UUID primary keys to integer '
+            'ones, the UUIDs becoming the public ids in a unique column. Databases in any '
+            'earlier layout, from the first one on, are brought up to date; those already '
+            'converted are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='databases',
+                            help='database to convert, repeatable; by default the shards '
+                                 'and the default database')
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or shards.aliases() + [DEFAULT_DB_ALIAS]
+        for alias in dict.fromkeys(aliases):
+            if alias not in connections:
+                raise CommandError('Unknown database %r.' % alias)
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('Only SQLite databases can be converted, %r is not.' % alias)
+            columns = self.columns(alias, Article._meta.db_table)
+            if not columns:
+                continue  # holds no articles
+            if 'uuid' in columns:
+                self.stdout.write('%s: already converted' % alias)
+                continue
+            articles, sentences = self.convert(alias, columns)
+            self.stdout.write('%s: %d articles, %d sentences converted'
+                              % (alias, articles, sentences))
+
+    def columns(self, using, table):
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            if table not in connection.introspection.table_names(cursor):
+                return []
+            return [column.name for column in
+                    connection.introspection.get_table_description(cursor, table)]
+
+    def convert(self, using, columns):
+        ''' Rebuild the tables in one transaction: the old ones are renamed
+            aside, the new ones created from the models and filled in primary
+            key order, articles by pub_date and sentences grouped by article,
+            so rows read together are stored together. `columns` are those
+            of the old articles table: the sentence counter and statistics
+            are computed when it predates them, and the deletion log is
+            created when missing. The search index is dropped and rebuilt
+            over the new keys within the transaction, so that a failed
+            conversion leaves it as it was. Returns the row counts. '''
+        connection = connections[using]
+        quote = connection.ops.quote_name
+        old = {model: model._meta.db_table + '_uuid' for model in (Article, Sentence)}
+        # foreign key checks are off while the schema editor is open
+        with connection.schema_editor() as editor, connection.cursor() as cursor:
+            search.FTSIndex(using).uninstall()
+            for model in (Sentence, Article):
+                editor.execute('ALTER TABLE %s RENAME TO %s'
+                               % (quote(model._meta.db_table), quote(old[model])))
+                # index names are per database, make room for the new ones
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                               "AND tbl_name = %s AND sql IS NOT NULL", [old[model]])
+                for name, in cursor.fetchall():
+                    editor.execute('DROP INDEX %s' % quote(name))
+            for model in (Article, Sentence):
+                editor.create_model(model)
+            if Tombstone._meta.db_table not in connection.introspection.table_names(cursor):
+                editor.create_model(Tombstone)
+            sources = {'uuid': 'a.id'}
+            for field in ('last_num', 'sentence_count', 'word_count', 'last_sentence_at'):
+                if field not in columns:
+                    sources[field] = 'NULL' if field == 'last_sentence_at' else '0'
+            editor.execute(self.copy(Article, 'a', sources, '%s a' % quote(old[Article]),
+                                     'a.pub_date, a.id'))
+            sources = {'uuid': 's.id', 'article_id': 'a.id'}
+            tables = '%s s JOIN %s a ON a.uuid = s.article_id' % (
+                quote(old[Sentence]), quote(Article._meta.db_table))
+            editor.execute(self.copy(Sentence, 's', sources, tables, 'a.id, s.num'))
+            for model in (Sentence, Article):
+                editor.execute('DROP TABLE %s' % quote(old[model]))
+            if 'last_num' not in columns:
+                editor.execute('UPDATE articles_article SET last_num = COALESCE((SELECT MAX(num) '
+                               'FROM articles_sentence s WHERE s.article_id = articles_article.id), 0)')
+            if 'sentence_count' not in columns:
+                self.rebuild_stats(using)
+            counts = []
+            for model in (Article, Sentence):
+                cursor.execute('SELECT COUNT(*) FROM %s' % quote(model._meta.db_table))
+                counts.append(cursor.fetchone()[0])
+            search.install(using)
+        return counts
+
+    def rebuild_stats(self, using):
+        ''' Compute the statistics of the articles, as rebuild_article_stats does. '''
+        command = rebuild_article_stats.Command()
+        drifted = [(pk, actual) for pk, stored, actual in command.compare(using)
+                   if stored != actual]
+        for pk, actual in drifted:
+            Article.objects.using(using).filter(pk=pk).update(
+                **dict(zip(rebuild_article_stats.FIELDS, actual)))
+
+    def copy(self, model, alias, sources, tables, ordering):
+        ''' INSERT ... SELECT of the rows of `model` from the old table
+            `alias`, columns read from the same name unless listed in
+            `sources`. '''
+        columns = [field.column for field in model._meta.local_concrete_fields
+                   if not field.primary_key]
+        return 'INSERT INTO %s (%s) SELECT %s FROM %s ORDER BY %s' % (
+            model._meta.db_table, ', '.join(columns),
+            ', '.join(sources.get(column, '%s.%s' % (alias, column)) for column in columns),
+            tables, ordering)
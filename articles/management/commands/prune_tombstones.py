@@ -0,0 +1,17 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db import router
+from django.utils import timezone
+from articles import conf, shards
+from articles.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = "Delete tombstones older than ARTICLES['TOMBSTONE_DAYS'], which sync no longer reads."
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=conf.get('TOMBSTONE_DAYS'))
+        deleted = 0
+        for using in shards.aliases() or [router.db_for_write(Tombstone)]:
+            deleted += Tombstone.objects.using(using).filter(deleted_at__lt=cutoff).delete()[0]
+        self.stdout.write('%d tombstones deleted' % deleted)
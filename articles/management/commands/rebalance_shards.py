@@ -0,0 +1,90 @@
+from collections import Counter
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from articles import search, shards
+from articles.models import Article, Sentence, Tombstone
+
+BATCH = 100  # sentences per INSERT, 7 query parameters each
+
+
+class Command(BaseCommand):
+    help = ('Move articles and their sentences to the shard of their author, '
+            'after shards were added or from an unsharded default database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report the articles that would move')
+
+    def handle(self, *args, **options):
+        targets = shards.aliases()
+        if not targets:
+            raise CommandError("No shards configured in ARTICLES['SHARDS'].")
+        sources = list(targets)
+        if DEFAULT_DB_ALIAS not in sources and self.holds_articles(DEFAULT_DB_ALIAS):
+            sources.append(DEFAULT_DB_ALIAS)
+        moves = Counter()
+        for source in sources:
+            rows = Article.objects.using(source).values_list('pk', 'author').iterator()
+            placements = [(pk, shards.for_author(author)) for pk, author in rows]
+            for pk, target in placements:
+                if target == source:
+                    continue
+                if not options['dry_run']:
+                    self.move(pk, source, target)
+                moves[source, target] += 1
+            if not options['dry_run']:
+                self.move_tombstones(source)
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write('%s -> %s: %d articles' % (source, target, count))
+        self.stdout.write('%d articles %s' % (sum(moves.values()),
+                                              'to move' if options['dry_run'] else 'moved'))
+
+    def holds_articles(self, using):
+        return Article._meta.db_table in connections[using].introspection.table_names()
+
+    def move(self, pk, source, target):
+        ''' Copy an article and its sentences as they are, public ids,
+            numbers and dates included, then delete them from `source`.
+            Primary keys are per database, the copies get new ones. The
+            article is write locked on `source` meanwhile. A copy left on
+            `target` by an interrupted run is complete, being committed at
+            once, and is kept. '''
+        with transaction.atomic(using=source):
+            articles = Article.objects.using(source)
+            articles.filter(pk=pk).update(last_num=F('last_num'))  # lock
+            article = articles.get(pk=pk)
+            if not Article.objects.using(target).filter(uuid=article.uuid).exists():
+                with transaction.atomic(using=target):
+                    copy = Article.objects.using(target)._insert(
+                        [article], fields=self.fields(Article), return_id=True, raw=True)
+                    sentences = (Sentence.objects.using(source).filter(article=pk)
+                                 .order_by('num').iterator(chunk_size=BATCH * 10))
+                    for batch in iter(lambda: list(islice(sentences, BATCH)), []):
+                        for sentence in batch:
+                            sentence.article_id = copy
+                        Sentence.objects.using(target)._insert(
+                            batch, fields=self.fields(Sentence), raw=True)
+                    # read back for indexes that need the new keys, not for FTS
+                    search.get_index(target).add(
+                        Sentence.objects.using(target).filter(article=copy))
+            # with its sentences, search entries and cached payloads, not logged for sync
+            article.delete(tombstone=False)
+
+    def fields(self, model):
+        return [field for field in model._meta.local_concrete_fields if not field.primary_key]
+
+    def move_tombstones(self, source):
+        ''' Move the deletion log of authors that moved off `source`. '''
+        tombstones = Tombstone.objects.using(source)
+        for author in tombstones.values_list('author', flat=True).distinct():
+            target = shards.for_author(author)
+            if target == source:
+                continue
+            with transaction.atomic(using=source), transaction.atomic(using=target):
+                rows = list(tombstones.filter(author=author).order_by('deleted_at', 'id'))
+                for row in rows:
+                    row.pk = None  # ids are per database
+                Tombstone.objects.using(target).bulk_create(rows, batch_size=BATCH)
+                tombstones.filter(author=author).delete()
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.db.models import F
+from articles import shards
+from articles.models import Article, Sentence, count_words
+
+FIELDS = ('sentence_count', 'word_count', 'last_sentence_at')
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized article statistics and fix drifted ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='only report drift, exit with an error if any')
+
+    def handle(self, *args, **options):
+        checked, drifted = 0, []
+        for using in shards.aliases() or [router.db_for_write(Article)]:
+            for pk, stored, actual in self.compare(using):
+                checked += 1
+                if stored != actual:
+                    drifted.append((using, pk))
+                    if options['verbosity'] > 1:
+                        self.stdout.write('%s: stored %s, actual %s' % (
+                            pk, dict(zip(FIELDS, stored)), dict(zip(FIELDS, actual))))
+        if not options['check']:
+            for using, pk in drifted:
+                self.rebuild(using, pk)
+        self.stdout.write('%d articles checked, %d drifted%s' % (
+            checked, len(drifted), '' if options['check'] or not drifted else ', rebuilt'))
+        if options['check'] and drifted:
+            raise CommandError('%d articles have drifted statistics' % len(drifted))
+
+    def compare(self, using):
+        ''' Yields (pk, stored, actual) for every article of database
+            `using`, merging articles and sentences, both streamed in
+            article order. '''
+        articles = (Article.objects.using(using).order_by('pk')
+                    .values_list('pk', *FIELDS).iterator(chunk_size=2000))
+        sentences = (Sentence.objects.using(using).order_by('article', 'num')
+                     .values_list('article', 'text', 'pub_date').iterator(chunk_size=2000))
+        sentence = next(sentences, None)
+        for pk, *stored in articles:
+            count, words, latest = 0, 0, None
+            while sentence is not None and sentence[0] <= pk:
+                if sentence[0] == pk:
+                    count += 1
+                    words += count_words(sentence[1])
+                    latest = sentence[2] if latest is None else max(latest, sentence[2])
+                sentence = next(sentences, None)
+            yield pk, tuple(stored), (count, words, latest)
+
+    def rebuild(self, using, pk):
+        ''' Recompute one article's statistics under its write lock. '''
+        articles = Article.objects.using(using)
+        with transaction.atomic(using=using):
+            articles.filter(pk=pk).update(last_num=F('last_num'))  # lock
+            count, words, latest = 0, 0, None
+            sentences = Sentence.objects.using(using).filter(article=pk)
+            for text, pub_date in sentences.values_list('text', 'pub_date'):
+                count += 1
+                words += count_words(text)
+                latest = pub_date if latest is None else max(latest, pub_date)
+            articles.filter(pk=pk).update(sentence_count=count, word_count=words,
+                                          last_sentence_at=latest)
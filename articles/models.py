@@ -1,33 +1,354 @@
 import uuid
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import (Case, Count, F, IntegerField, Max, OuterRef, Subquery,
+                              TextField, Value, When)
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
+from django.utils import timezone
 from datetime import datetime
+from articles import conf, shards
+from articles.signals import sentences_changed
+
+CASE_BATCH = 300  # rows per CASE UPDATE, 3 query parameters each
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def latest_pub_date():
+    ''' Subquery of the pub_date of an article's newest sentence. '''
+    return Subquery(Sentence.objects.filter(article=OuterRef('pk'))
+                    .order_by('-pub_date').values('pub_date')[:1])
+
+
+class ShardedQuerySet(models.QuerySet):
+    author_lookup = 'author'
+
+    def for_author(self, author_id):
+        ''' Rows of `author_id`, on the author's shard. '''
+        return self.using(shards.for_author(author_id)).filter(**{self.author_lookup: author_id})
+
+    def create(self, **kwargs):
+        ''' Like QuerySet.create(), but the row is saved on its own shard
+            unless a database was picked with using(). '''
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
+class SentenceQuerySet(ShardedQuerySet):
+    author_lookup = 'article__author'  # the article's author
+
 
 class Article(models.Model):
-    ''' Represents an article. '''
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    ''' Represents an article.
+        sentence_count, word_count and last_sentence_at are denormalized
+        from the sentences, in the same transactions as the writes: bulk
+        writes go through the methods below, single rows through Sentence's
+        save() and delete(). Queryset writes bypass them, rebuild with
+        `manage.py rebuild_article_stats`.
+        Articles may be sharded by author, see articles/shards.py: the
+        methods below run on the database the article was loaded from or
+        saved to.
+        The primary key is an integer, compact in foreign keys and indexes
+        and local to the database; `uuid` is the public id, in URLs and
+        payloads, kept when an article moves to another shard. '''
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)  # public id
     title = models.CharField(max_length=60)  # article title
     pub_date = models.DateTimeField(auto_now_add=True)  # date added
     mod_date = models.DateTimeField(auto_now=True)  # date modified
-    author = models.ForeignKey(User, blank=True, on_delete=models.CASCADE)  # author
+    # users may live in another database, see articles/receivers.py for the cascade
+    author = models.ForeignKey(User, blank=True, on_delete=models.DO_NOTHING,
+                               db_constraint=False)  # author
+    last_num = models.IntegerField(default=0, editable=False)  # last allocated sentence number
+    sentence_count = models.IntegerField(default=0, editable=False)
+    word_count = models.IntegerField(default=0, editable=False)
+    last_sentence_at = models.DateTimeField(null=True, editable=False)  # newest sentence pub_date
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [  # keyset pagination of each ordering
+            models.Index(fields=['author', 'pub_date', 'id']),
+            models.Index(fields=['author', 'sentence_count', 'id']),
+            models.Index(fields=['author', 'word_count', 'id']),
+            models.Index(fields=['author', 'last_sentence_at', 'id']),
+            models.Index(fields=['author', 'mod_date', 'id']),  # sync
+        ]
 
     def __str__(self):
         return self.title
 
+    def delete(self, *args, tombstone=True, **kwargs):
+        ''' Sentences are removed with a single DELETE instead of being
+            collected and deleted row by row with their signals.
+            The deletion is logged for sync unless `tombstone` is off. '''
+        using = kwargs.get('using') or self.db()
+        with transaction.atomic(using=using):
+            sentences = Sentence.objects.using(using).filter(article=self)
+            sentences._raw_delete(using)
+            if tombstone:
+                Tombstone.objects.using(using).create(author_id=self.author_id, article=self.uuid)
+            return super().delete(*args, **kwargs)
+
+    def db(self):
+        ''' Alias of the database holding the article. '''
+        return router.db_for_write(Article, instance=self)
+
+    def allocate_nums(self, count, **updates):
+        ''' Reserve `count` consecutive sentence numbers, returns the first one.
+            The counter is bumped with a single UPDATE, which takes the row
+            (or, on SQLite, database) write lock, so concurrent writers are
+            serialized until the surrounding transaction ends. Sentences
+            created without going through the counter are accounted for.
+            `updates` are applied by the same UPDATE and read back. '''
+        articles = Article.objects.using(self.db())
+        last = Sentence.objects.filter(article=OuterRef('pk')).order_by('-num').values('num')[:1]
+        articles.filter(pk=self.pk).update(
+            last_num=Greatest(F('last_num'), Coalesce(Subquery(last), 0)) + count, **updates)
+        fields = ['last_num'] + list(updates)
+        values = articles.values_list(*fields).get(pk=self.pk)
+        for field, value in zip(fields, values):
+            setattr(self, field, value)
+        return self.last_num - count + 1
+
+    def append_sentences(self, texts, author):
+        ''' Append sentences with consecutive numbers after the last one.
+            All rows are written with a single batched insert, their primary
+            keys read back with one range query where the insert does not
+            return them. '''
+        using = self.db()
+        with transaction.atomic(using=using):
+            first = self.allocate_nums(len(texts), sentence_count=F('sentence_count') + len(texts),
+                                       word_count=F('word_count') + sum(map(count_words, texts)),
+                                       mod_date=timezone.now())
+            sentences = [Sentence(article=self, num=first + i, text=text, author=author)
+                         for i, text in enumerate(texts)]
+            Sentence.objects.using(using).bulk_create(sentences)
+            if not connections[using].features.can_return_ids_from_bulk_insert:
+                pks = dict(Sentence.objects.using(using).filter(article=self, num__gte=first)
+                           .values_list('num', 'pk'))
+                for sentence in sentences:
+                    sentence.pk = pks[sentence.num]
+            # pub_dates are only known once inserted
+            self.last_sentence_at = sentences[-1].pub_date
+            Article.objects.using(using).filter(pk=self.pk).update(
+                last_sentence_at=self.last_sentence_at)
+            sentences_changed.send(sender=Article, article=self, created=sentences)
+        return sentences
+
+    def delete_sentence(self, sentence):
+        ''' Delete a sentence and shift the following ones down by one.
+            The shift is two set-based UPDATEs: the rows are first moved to
+            negative numbers so that no intermediate state collides with
+            the ('article', 'num') unique constraint.
+            Numbers are left with a gap when ARTICLES['SENTENCE_GAPS'] is on.
+            Gaps left while it was are closed by the first delete without
+            it, which renumbers all sentences, see compact_sentences(). '''
+        gaps = conf.get('SENTENCE_GAPS')
+        using = self.db()
+        with transaction.atomic(using=using):
+            # lock the article first so that deletes and appends serialize
+            Article.objects.using(using).filter(pk=self.pk).update(
+                last_num=F('last_num') - (0 if gaps else 1))
+            sentence.refresh_from_db(fields=['num'])
+            if not gaps:
+                numbers = self.sentences.aggregate(
+                    last=Max('num'), total=Count('id'), counter=Max('article__last_num'))
+            sentence.delete()
+            if gaps:
+                return
+            if not numbers['last'] == numbers['total'] == numbers['counter'] + 1:
+                self.compact_sentences()  # numbered in gap mode
+                return
+            self.sentences.filter(num__gt=sentence.num).update(num=1 - F('num'))
+            self.sentences.filter(num__lt=0).update(num=0 - F('num'), mod_date=timezone.now())
+            sentences_changed.send(sender=Article, article=self, created=[],
+                                   renumbered={'op': 'shift', 'from': sentence.num + 1, 'by': -1})
+
+    def compact_sentences(self):
+        ''' Renumber the sentences 1 to n in their current order and set
+            the counter to n, closing the gaps deletes leave with
+            ARTICLES['SENTENCE_GAPS'] on. Returns whether any number changed. '''
+        using = self.db()
+        with transaction.atomic(using=using):
+            Article.objects.using(using).filter(pk=self.pk).update(last_num=F('last_num'))  # lock
+            nums = list(self.sentences.order_by('num').values_list('num', flat=True))
+            moves = [(old, new) for new, old in enumerate(nums, 1) if old != new]
+            self.renumber(moves)
+            Article.objects.using(using).filter(pk=self.pk).update(last_num=len(nums))
+            self.last_num = len(nums)
+            if moves:
+                sentences_changed.send(sender=Article, article=self, created=[],
+                                       renumbered={'op': 'compact', 'order': nums})
+        return bool(moves)
+
+    def move_sentence(self, sentence, to):
+        ''' Move a sentence to number `to`, shifting the sentences in between
+            by one towards its old number. Three set-based UPDATEs whatever
+            the distance: the moved sentence and the shifted range are parked
+            on negative numbers, then flipped back, so the ('article', 'num')
+            unique constraint holds at every step. Ids and pub_dates are kept.
+            Raises ValueError when `to` is not between 1 and the last number. '''
+        using = self.db()
+        with transaction.atomic(using=using):
+            Article.objects.using(using).filter(pk=self.pk).update(last_num=F('last_num'))  # lock
+            sentence.refresh_from_db(fields=['num'])
+            last = self.sentences.aggregate(last=Max('num'))['last']
+            if not 1 <= to <= last:
+                raise ValueError('Expected a sentence number between 1 and %d.' % last)
+            if to == sentence.num:
+                return sentence
+            Sentence.objects.using(using).filter(pk=sentence.pk).update(num=0 - to)
+            if to > sentence.num:
+                self.sentences.filter(num__gt=sentence.num, num__lte=to).update(num=1 - F('num'))
+            else:
+                self.sentences.filter(num__gte=to, num__lt=sentence.num).update(num=-1 - F('num'))
+            self.sentences.filter(num__lt=0).update(num=0 - F('num'), mod_date=timezone.now())
+            sentences_changed.send(sender=Article, article=self, created=[],
+                                   renumbered={'op': 'move', 'from': sentence.num, 'to': to})
+        sentence.refresh_from_db(fields=['num', 'mod_date'])
+        return sentence
+
+    def reorder_sentences(self, order):
+        ''' Renumber all sentences at once: `order` lists every current
+            sentence number in the new order, the sentence listed i-th takes
+            the i-th smallest number, see renumber().
+            Raises ValueError unless `order` is a permutation of the numbers. '''
+        using = self.db()
+        with transaction.atomic(using=using):
+            Article.objects.using(using).filter(pk=self.pk).update(last_num=F('last_num'))  # lock
+            nums = sorted(self.sentences.values_list('num', flat=True))
+            if sorted(order) != nums:
+                raise ValueError('Expected a permutation of the %d sentence numbers.' % len(nums))
+            moves = [(old, new) for old, new in zip(order, nums) if old != new]
+            if not moves:
+                return
+            self.renumber(moves)
+            sentences_changed.send(sender=Article, article=self, created=[],
+                                   renumbered={'op': 'reorder', 'order': order})
+
+    def renumber(self, moves):
+        ''' Apply (old number, new number) moves, in a transaction holding
+            the article's lock. Changed rows are parked on negative numbers
+            with CASE UPDATEs (one per `CASE_BATCH` rows, to stay under query
+            parameter limits) and flipped back with one more. '''
+        if not moves:
+            return
+        for i in range(0, len(moves), CASE_BATCH):
+            batch = moves[i:i + CASE_BATCH]
+            self.sentences.filter(num__in=[old for old, new in batch]).update(
+                num=Case(*[When(num=old, then=Value(-new)) for old, new in batch],
+                         output_field=IntegerField()))
+        self.sentences.filter(num__lt=0).update(num=0 - F('num'), mod_date=timezone.now())
+
+    def update_sentences(self, sentences):
+        ''' Write the texts of already modified sentences with CASE UPDATEs,
+            one per `CASE_BATCH` rows, in one transaction. '''
+        now = timezone.now()
+        words = sum(count_words(s.text) - count_words(s.loaded_text()) for s in sentences)
+        using = self.db()
+        with transaction.atomic(using=using):
+            if words:
+                Article.objects.using(using).filter(pk=self.pk).update(
+                    word_count=F('word_count') + words, mod_date=now)
+            for i in range(0, len(sentences), CASE_BATCH):
+                batch = sentences[i:i + CASE_BATCH]
+                Sentence.objects.using(using).filter(pk__in=[s.pk for s in batch]).update(
+                    text=Case(*[When(pk=s.pk, then=Value(s.text)) for s in batch],
+                              output_field=TextField()),
+                    mod_date=now)
+            for sentence in sentences:
+                sentence.mod_date = now
+                sentence._loaded_text = sentence.text
+            sentences_changed.send(sender=Article, article=self, created=[], updated=sentences)
+
 
 class Sentence(models.Model):
     ''' Represents an article's sentence. '''
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)  # public id
     article = models.ForeignKey(Article, related_name='sentences', on_delete=models.CASCADE)
     num = models.IntegerField(default=1, blank=True)
     text = models.TextField()  # sentence text
     pub_date = models.DateTimeField(auto_now_add=True)  # date added
     mod_date = models.DateTimeField(auto_now=True)  # date last modified
-    author = models.ForeignKey(User, blank=True, on_delete=models.CASCADE)  # user that added a sentence
-   
+    author = models.ForeignKey(User, blank=True, on_delete=models.DO_NOTHING,
+                               db_constraint=False)  # user that added a sentence
+
+    objects = SentenceQuerySet.as_manager()
+
     class Meta:
         unique_together = ('article', 'num')
         ordering = ['num']
+        indexes = [models.Index(fields=['author', 'mod_date', 'id'])]  # sync
 
     def __str__(self):
         return self.text
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'text' in field_names:  # for word count deltas
+            instance._loaded_text = values[field_names.index('text')]
+        return instance
+
+    def loaded_text(self):
+        ''' The text as stored, before unsaved changes. '''
+        if not hasattr(self, '_loaded_text'):
+            self._loaded_text = (Sentence.objects.db_manager(self._state.db)
+                                 .values_list('text', flat=True).get(pk=self.pk))
+        return self._loaded_text
+
+    def save(self, *args, **kwargs):
+        ''' Saving a single sentence updates its article's statistics. '''
+        using = kwargs.get('using') or router.db_for_write(Sentence, instance=self)
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            stats = dict(sentence_count=F('sentence_count') + 1,
+                         word_count=F('word_count') + count_words(self.text))
+        elif update_fields is None or 'text' in update_fields:
+            words = count_words(self.text) - count_words(self.loaded_text())
+            stats = dict(word_count=F('word_count') + words) if words else {}
+        else:
+            stats = {}
+        if not stats:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            if 'sentence_count' in stats:
+                stats['last_sentence_at'] = self.pub_date
+            Article.objects.using(using).filter(pk=self.article_id).update(
+                mod_date=self.mod_date, **stats)
+        self._loaded_text = self.text
+
+    def delete(self, *args, **kwargs):
+        ''' Deleting a single sentence updates its article's statistics
+            and is logged for sync. '''
+        using = kwargs.get('using') or router.db_for_write(Sentence, instance=self)
+        words = count_words(self.loaded_text())
+        with transaction.atomic(using=using, savepoint=False):
+            result = super().delete(*args, **kwargs)
+            tombstone = Tombstone.objects.using(using).create(
+                author_id=self.article.author_id, article=self.article.uuid, sentence=self.uuid)
+            Article.objects.using(using).filter(pk=self.article_id).update(
+                sentence_count=F('sentence_count') - 1, word_count=F('word_count') - words,
+                last_sentence_at=latest_pub_date(), mod_date=tombstone.deleted_at)
+        return result
+
+
+class Tombstone(models.Model):
+    ''' Deletion log of articles and sentences, read by /sync/.
+        Kept with the author's articles, pruned after
+        ARTICLES['TOMBSTONE_DAYS'] with `manage.py prune_tombstones`. '''
+    author = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                               related_name='+')  # the article's author
+    article = models.UUIDField()  # public id of the deleted article, or the deleted sentence's
+    sentence = models.UUIDField(null=True)  # public id of the deleted sentence, null if none
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['author', 'deleted_at', 'id'])]
@@ -0,0 +1,133 @@
+import base64
+import json
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from articles import conf
+
+
+class KeysetPagination(BasePagination):
+    ''' Cursor pagination over a unique ordering key.
+        A page is selected with a WHERE on the key of the previous page's
+        last row instead of an OFFSET, so deep pages cost the same as the
+        first one. The body stays a plain list, the next page is linked
+        from a `Link: <url>; rel="next"` header.
+        Key fields may be descending ('-field') and nullable, NULLs are
+        placed where the database sorts them. `?ordering=[-]field` picks
+        the leading key among `ordering_fields`, ties broken by the rest
+        of the default ordering. '''
+    ordering = ()
+    ordering_fields = ()
+    ordering_query_param = 'ordering'
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            nulls_largest = connections[queryset.db].features.nulls_order_largest
+            queryset = queryset.filter(self.after(position, queryset.model, nulls_largest))
+
+        page = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = [getattr(page[-1], field.lstrip('-')) for field in self.ordering]
+        return page
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if not ordering:
+            return self.ordering
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({self.ordering_query_param: [
+                'Expected one of %s, optionally prefixed with -.' % ', '.join(self.ordering_fields)]})
+        # the tie breakers follow the direction of the leading key
+        descending = ordering.startswith('-')
+        return (ordering,) + tuple(('-' if descending else '') + field.lstrip('-')
+                                   for field in self.ordering[1:])
+
+    def get_paginated_response(self, data):
+        headers = {}
+        if self.next_position is not None:
+            headers['Link'] = '<%s>; rel="next"' % self.get_next_link()
+        return Response(data, headers=headers)
+
+    def get_next_link(self):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return conf.get('PAGE_SIZE')
+        return max(1, min(page_size, conf.get('MAX_PAGE_SIZE')))
+
+    def after(self, position, model, nulls_largest=False):
+        ''' Rows strictly after `position` in key order.
+            The leading bound lets the database seek the index. '''
+        condition, equal = Q(), Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            beyond = self.beyond(model, field, value, nulls_largest)
+            if beyond is not None:
+                condition |= equal & beyond
+            equal &= Q(**{name + '__isnull': True}) if value is None else Q(**{name: value})
+        field, value = self.ordering[0], position[0]
+        if value is None:
+            bound = Q(**{field.lstrip('-') + '__isnull': True})
+            beyond = self.beyond(model, field, value, nulls_largest)
+            if beyond is not None:
+                bound |= beyond
+        else:
+            bound = self.beyond(model, field, value, nulls_largest, inclusive=True)
+        return bound & condition
+
+    def beyond(self, model, field, value, nulls_largest, inclusive=False):
+        ''' Condition on `field` (prefixed with - when descending) selecting
+            values after `value`, None when no value is. '''
+        name, descending = field.lstrip('-'), field.startswith('-')
+        nulls_first = descending == nulls_largest  # in iteration order
+        if value is None:
+            return Q(**{name + '__isnull': False}) if nulls_first else None
+        lookup = ('__lt' if descending else '__gt') + ('e' if inclusive else '')
+        condition = Q(**{name + lookup: value})
+        if not nulls_first and model._meta.get_field(name).null:
+            condition |= Q(**{name + '__isnull': True})
+        return condition
+
+    def encode_cursor(self, position):
+        raw = json.dumps([None if value is None else str(value) for value in position])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field.lstrip('-')).to_python(value)
+                    for field, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ArticlePagination(KeysetPagination):
+    ordering = ('pub_date', 'id')
+    ordering_fields = ('pub_date', 'sentence_count', 'word_count', 'last_sentence_at')
+
+
+class SentencePagination(KeysetPagination):
+    ordering = ('num',)
@@ -0,0 +1,11 @@
+from rest_framework.parsers import BaseParser
+
+
+class PlainTextParser(BaseParser):
+    ''' Parses a text/plain body into a string. '''
+    media_type = 'text/plain'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        return stream.read().decode(encoding)
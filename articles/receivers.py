@@ -0,0 +1,94 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from articles import cache, events, search, shards
+from articles.models import Article, Sentence, Tombstone
+from articles.serializers import SentenceSerializer
+from articles.signals import sentences_changed
+from config.renderers import JSONRenderer
+
+
+def invalidate(article_id, using):
+    ''' Drop cached payloads of an article, by public id, now and again once the
+        transaction on `using` commits, so that a concurrent reader cannot cache
+        rows that were current before the commit. '''
+    cache.invalidate(article_id)
+    transaction.on_commit(lambda: cache.invalidate(article_id), using=using)
+
+
+def publish(article_id, using, name, payloads):
+    ''' Publish events to the article's stream once the transaction
+        commits, when anyone watches it. `payloads()` is called then. '''
+    if events.watched(article_id):
+        def send():
+            renderer = JSONRenderer()
+            for payload in payloads():
+                events.publish(article_id, name, renderer.render(payload).decode('utf-8'))
+        transaction.on_commit(send, using=using)
+
+
+def sentence_payloads(sentences):
+    return lambda: SentenceSerializer(sentences, many=True).data
+
+
+@receiver(post_save, sender=Article)
+def article_changed(sender, instance, using, **kwargs):
+    invalidate(instance.uuid, using)
+
+
+@receiver(post_delete, sender=Article)
+def article_deleted(sender, instance, using, **kwargs):
+    invalidate(instance.uuid, using)
+    search.get_index(using).remove_article(instance.pk)
+    if events.watched(instance.uuid):
+        article_id = str(instance.uuid)
+        publish(article_id, using, 'article_deleted', lambda: [{'id': article_id}])
+        transaction.on_commit(lambda: events.close(article_id), using=using)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    ''' Cascade to the user's articles and sentences, which may be on a
+        shard rather than in the user's database. '''
+    for article in Article.objects.for_author(instance.pk):
+        article.delete()
+    for using in shards.aliases() or [None]:
+        Sentence.objects.using(using).filter(author=instance.pk).delete()
+        Tombstone.objects.using(using).filter(author=instance.pk).delete()
+
+
+@receiver(post_save, sender=Sentence)
+def sentence_saved(sender, instance, using, created, **kwargs):
+    invalidate(instance.article.uuid, using)
+    search.get_index(using).add([instance])
+    publish(instance.article.uuid, using, 'created' if created else 'updated',
+            sentence_payloads([instance]))
+
+
+@receiver(post_delete, sender=Sentence)
+def sentence_deleted(sender, instance, using, **kwargs):
+    invalidate(instance.article.uuid, using)
+    search.get_index(using).remove(instance)
+    payload = {'id': str(instance.uuid), 'num': instance.num}
+    publish(instance.article.uuid, using, 'deleted', lambda: [payload])
+
+
+@receiver(sentences_changed)
+def sentences_bulk_changed(sender, article, created=(), updated=(), renumbered=None, **kwargs):
+    using = article._state.db or 'default'
+    invalidate(article.uuid, using)
+    if created or updated:
+        search.get_index(using).add(list(created) + list(updated))
+    if created:
+        publish(article.uuid, using, 'created', sentence_payloads(created))
+    if updated:
+        publish(article.uuid, using, 'updated', sentence_payloads(updated))
+    if renumbered:
+        publish(article.uuid, using, 'renumbered', lambda: [renumbered])
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == 'articles':
+        search.install(using)
@@ -0,0 +1,73 @@
+import json
+from rest_framework.renderers import BaseRenderer
+
+
+class StreamingRenderer(BaseRenderer):
+    ''' Renderer for streamed exports. `stream()` turns an iterator of
+        (num, text) rows into chunks of `chunk_lines` lines, `render()` is
+        only used for error responses. '''
+    charset = 'utf-8'
+    chunk_lines = 500
+
+    def stream(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(self.line(*row))
+            if len(chunk) >= self.chunk_lines:
+                yield ''.join(chunk).encode(self.charset)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk).encode(self.charset)
+
+    def line(self, num, text):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data, ensure_ascii=False) + '\n').encode(self.charset)
+
+
+class NDJSONRenderer(StreamingRenderer):
+    ''' One {"num": ..., "text": ...} JSON object per line. '''
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def line(self, num, text):
+        return json.dumps({'num': num, 'text': text}, ensure_ascii=False) + '\n'
+
+
+class PlainTextRenderer(StreamingRenderer):
+    ''' One sentence text per line, line breaks within a sentence turned
+        into spaces: the boundaries str.splitlines() splits on, as the
+        plain text parser of sentence appends does. '''
+    media_type = 'text/plain'
+    format = 'text'
+
+    def line(self, num, text):
+        return ' '.join(text.splitlines()) + '\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    ''' Server-Sent Events. `stream()` turns an iterator of events, None
+        for heartbeats, into messages, `render()` is only used for error
+        responses. '''
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+    retry = 3000  # milliseconds clients wait before reconnecting
+
+    def stream(self, events):
+        yield ('retry: %d\n\n' % self.retry).encode(self.charset)
+        for event in events:
+            if event is None:
+                yield b': heartbeat\n\n'
+            elif event.id is None:
+                yield ('event: %s\ndata: %s\n\n' % (event.name, event.data)).encode(self.charset)
+            else:
+                yield ('id: %s\nevent: %s\ndata: %s\n\n' % event).encode(self.charset)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data, ensure_ascii=False) + '\n').encode(self.charset)
@@ -0,0 +1,214 @@
+''' Full-text search over sentences.
+    On SQLite with FTS5 the index is an external content FTS5 table over
+    articles_sentence, kept in sync incrementally by triggers, so bulk
+    inserts and queryset updates are indexed too. It is keyed on the
+    sentence's integer primary key, which is its rowid. Elsewhere a pure-Python
+    inverted index, built on first use and updated from Sentence signals,
+    is used as a fallback; it only sees writes made by its own process. '''
+import re
+import threading
+from collections import defaultdict
+from django.db import DatabaseError, connections
+from articles.models import Article, Sentence
+
+MAX_MATCHES = 1000  # matching sentences considered per query
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def phrase(query):
+    ''' FTS5 phrase query matching `query` literally. '''
+    return '"%s"' % query.replace('"', '""')
+
+
+def group(rows, limit):
+    ''' Group (article public id, title, num, score) rows, best first, into
+        ranked articles with their matching sentence numbers. '''
+    results = {}
+    for article_id, title, num, score in rows:
+        result = results.get(article_id)
+        if result is None:
+            result = results[article_id] = {'article': article_id, 'title': title,
+                                            'sentences': [], 'score': score}
+        result['sentences'].append(num)
+        result['score'] = max(result['score'], score)
+    ranked = sorted(results.values(), key=lambda r: -r['score'])[:limit]
+    for result in ranked:
+        result['sentences'].sort()
+        result['score'] = round(result['score'], 4)
+    return ranked
+
+
+class FTSIndex(object):
+    ''' SQLite FTS5 index maintained by triggers. '''
+    table = 'articles_sentence_fts'
+    statements = [
+        "CREATE VIRTUAL TABLE {fts} USING fts5(text, content='articles_sentence', "
+        "content_rowid='id')",
+        "CREATE TRIGGER {fts}_insert AFTER INSERT ON articles_sentence BEGIN "
+        "INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+        "CREATE TRIGGER {fts}_delete AFTER DELETE ON articles_sentence BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text); END",
+        "CREATE TRIGGER {fts}_update AFTER UPDATE OF text ON articles_sentence BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, text) VALUES ('delete', old.id, old.text); "
+        "INSERT INTO {fts}(rowid, text) VALUES (new.id, new.text); END",
+    ]
+
+    def __init__(self, using):
+        self.using = using
+
+    def installed(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+            return cursor.fetchone() is not None
+
+    def install(self):
+        ''' Create the table and triggers and index existing sentences. '''
+        with connections[self.using].cursor() as cursor:
+            for statement in self.statements:
+                cursor.execute(statement.format(fts=self.table))
+        self.rebuild()
+
+    def uninstall(self):
+        ''' Drop the table and triggers. '''
+        with connections[self.using].cursor() as cursor:
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute('DROP TRIGGER IF EXISTS {fts}_{trigger}'.format(
+                    fts=self.table, trigger=trigger))
+            cursor.execute('DROP TABLE IF EXISTS {fts}'.format(fts=self.table))
+
+    def rebuild(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=self.table))
+
+    def search(self, user_id, query, limit):
+        sql = ('SELECT a.uuid, a.title, s.num, -bm25({fts}) AS score FROM {fts} '
+               'JOIN articles_sentence s ON s.id = {fts}.rowid '
+               'JOIN articles_article a ON a.id = s.article_id '
+               'WHERE {fts} MATCH %s AND a.author_id = %s '
+               'ORDER BY bm25({fts}) LIMIT %s').format(fts=self.table)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, [phrase(query), user_id, MAX_MATCHES])
+            rows = [(Article._meta.get_field('uuid').to_python(article_id), title, num, score)
+                    for article_id, title, num, score in cursor.fetchall()]
+        return group(rows, limit)
+
+    def add(self, sentences):
+        pass  # maintained by triggers
+
+    def remove(self, sentence):
+        pass
+
+    def remove_article(self, article_id):
+        pass
+
+
+class MemoryIndex(object):
+    ''' Pure-Python inverted index: token -> {sentence id: article id}. '''
+    token_re = re.compile(r'\w+')
+
+    def __init__(self, using):
+        self.using = using
+        self.postings = None
+        self.documents = None  # sentence id -> tokens
+        self.articles = None  # article id -> sentence ids
+        self.lock = threading.Lock()
+
+    def tokens(self, text):
+        return self.token_re.findall(text.lower())
+
+    def build(self):
+        self.postings, self.documents, self.articles = defaultdict(dict), {}, defaultdict(set)
+        rows = (Sentence.objects.using(self.using)
+                .values_list('id', 'article_id', 'text').iterator(chunk_size=2000))
+        for sentence_id, article_id, text in rows:
+            self._add(sentence_id, article_id, text)
+
+    def add(self, sentences):
+        with self.lock:
+            if self.postings is None:
+                return  # picked up by the first build
+            for sentence in sentences:
+                self._discard(sentence.pk)
+                self._add(sentence.pk, sentence.article_id, sentence.text)
+
+    def remove(self, sentence):
+        with self.lock:
+            if self.postings is not None:
+                self._discard(sentence.pk)
+                self.articles[sentence.article_id].discard(sentence.pk)
+
+    def remove_article(self, article_id):
+        with self.lock:
+            if self.postings is not None:
+                for sentence_id in self.articles.pop(article_id, ()):
+                    self._discard(sentence_id)
+
+    def _add(self, sentence_id, article_id, text):
+        tokens = set(self.tokens(text))
+        self.documents[sentence_id] = tokens
+        self.articles[article_id].add(sentence_id)
+        for token in tokens:
+            self.postings[token][sentence_id] = article_id
+
+    def _discard(self, sentence_id):
+        for token in self.documents.pop(sentence_id, ()):
+            del self.postings[token][sentence_id]
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def search(self, user_id, query, limit):
+        tokens = self.tokens(query)
+        if not tokens:
+            return []
+        articles = set(Article.objects.using(self.using).filter(author=user_id)
+                       .values_list('pk', flat=True))
+        with self.lock:
+            if self.postings is None:
+                self.build()
+            postings = sorted((self.postings.get(token, {}) for token in tokens), key=len)
+            # the user's sentences with every token, before any limit
+            candidates = [sentence_id for sentence_id, article_id in postings[0].items()
+                          if article_id in articles
+                          and all(sentence_id in other for other in postings[1:])]
+        words = ' '.join(tokens)
+        rows = []
+        sentences = (Sentence.objects.using(self.using)
+                     .filter(pk__in=sorted(candidates)[:MAX_MATCHES], article__author=user_id)
+                     .values_list('article__uuid', 'article__title', 'num', 'text'))
+        for article_id, title, num, text in sentences:
+            normalized = ' '.join(self.tokens(text))
+            hits = (' %s ' % normalized).count(' %s ' % words)
+            if hits:
+                rows.append((article_id, title, num, hits / float(len(normalized.split()))))
+        return group(rows, limit)
+
+
+def get_index(using='default'):
+    ''' The search index of a database, installing FTS5 on SQLite if needed. '''
+    index = _indexes.get(using)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(using)
+            if index is None:
+                index = _indexes[using] = _create(using)
+    return index
+
+
+def _create(using):
+    if connections[using].vendor == 'sqlite':
+        index = FTSIndex(using)
+        try:
+            if not index.installed():
+                index.install()
+            return index
+        except DatabaseError:  # SQLite built without FTS5
+            pass
+    return MemoryIndex(using)
+
+
+def install(using):
+    ''' Set up the index of a freshly migrated database. '''
+    _indexes.pop(using, None)
+    get_index(using)
@@ -1,6 +1,40 @@
 from django.contrib.auth.models import User
-from .models import Article, Sentence 
+from .models import Article, Sentence, Tombstone
 from rest_framework import serializers
+from config.middleware import timer
+
+class DynamicFieldsMixin(object):
+    ''' Keeps only the fields listed in context['fields'] (all if empty)
+        and drops Meta.expandable fields that are not in context['expand']. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        expand = self.context.get('expand', ())
+        expandable = getattr(self.Meta, 'expandable', ())
+        for name in list(self.fields):
+            if (name in expandable and name not in expand) or (fields and name not in fields):
+                self.fields.pop(name)
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    ''' ListSerializer reporting its serialization time to the instrumentation. '''
+
+    @property
+    def data(self):
+        with timer('serialize'):
+            return super().data
+
+
+class TimedSerializerMixin(object):
+    ''' Reports serialization time to the instrumentation;
+        set Meta.list_serializer_class to TimedListSerializer as well. '''
+
+    @property
+    def data(self):
+        with timer('serialize'):
+            return super().data
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,17 +42,57 @@ class UserSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class SentenceSerializer(serializers.ModelSerializer):
+class SentenceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    ''' Only the text is writable: numbers change through move and reorder,
+        the article and author are set on creation. Sentences and their
+        article are identified by their public ids, serialize sentences
+        with their article loaded. '''
+    id = serializers.UUIDField(source='uuid', read_only=True)
+    article = serializers.ReadOnlyField(source='article.uuid')
 
     class Meta:
         model = Sentence
-        fields = '__all__'
+        fields = ('id', 'num', 'text', 'pub_date', 'mod_date', 'article', 'author')
+        read_only_fields = ('num', 'author')
+        # numbers are assigned by Article methods, which keep ('article', 'num')
+        # unique; the default validator would turn num into a hidden field
+        validators = []
+        list_serializer_class = TimedListSerializer
+
+    def update(self, instance, validated_data):
+        ''' Write only the changed columns, nothing when none changed. '''
+        changed = [name for name, value in validated_data.items()
+                   if getattr(instance, name) != value]
+        if changed:
+            for name in changed:
+                setattr(instance, name, validated_data[name])
+            instance.save(update_fields=changed + ['mod_date'])
+        return instance
 
 
-class ArticleSerializer(serializers.ModelSerializer):
+class ArticleSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     
+    id = serializers.UUIDField(source='uuid', read_only=True)  # the public id
     sentences = serializers.StringRelatedField(many=True, read_only=True)
 
     class Meta:
         model = Article
-        fields = '__all__'
+        exclude = ('last_num', 'uuid')
+        expandable = ('sentences',)
+        list_serializer_class = TimedListSerializer
+
+
+class TombstoneSerializer(serializers.ModelSerializer):
+    ''' A deleted article, or a deleted sentence and its article. '''
+    type = serializers.SerializerMethodField()
+    id = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Tombstone
+        fields = ('type', 'id', 'article', 'deleted_at')
+
+    def get_type(self, obj):
+        return 'article' if obj.sentence is None else 'sentence'
+
+    def get_id(self, obj):
+        return str(obj.article if obj.sentence is None else obj.sentence)
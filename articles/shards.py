@@ -0,0 +1,84 @@
+''' Sharding of articles and sentences by author.
+    ARTICLES['SHARDS'] lists the database aliases holding them; an author's
+    articles, their sentences and the author's tombstones all live on the
+    shard for_author() maps the author to. Users and everything else stay on 'default'. Queries
+    are routed by the instance they come from, top-level ones must pick the
+    shard with Article.objects.for_author() / Sentence.objects.for_author().
+    Without shards nothing is routed here.
+    The mapping is a jump consistent hash of the author id over the list of
+    aliases: appending an alias only moves authors to the new shard, about
+    1/N of them, which `manage.py rebalance_shards` copies over. '''
+from articles import conf
+
+LABEL = 'articles'
+
+
+def aliases():
+    ''' Shard aliases, empty when sharding is off. '''
+    return list(conf.get('SHARDS'))
+
+
+def jump_hash(key, buckets):
+    ''' Lamping and Veach's jump consistent hash of integer `key` into
+        range(buckets). '''
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def for_author(author_id, shards=None):
+    ''' Alias of the shard of `author_id`, None when sharding is off. '''
+    shards = aliases() if shards is None else shards
+    if not shards:
+        return None
+    return shards[jump_hash(int(author_id), len(shards))]
+
+
+def for_instance(instance):
+    ''' Alias of the shard an article, sentence or tombstone lives or belongs on.
+        Other instances are hints of the author, e.g. when one is assigned
+        to a new article or follows a user's reverse relation. A new
+        sentence follows its article, None until one is assigned. '''
+    if instance._meta.app_label != LABEL:
+        return for_author(instance.pk)
+    if instance._state.db:
+        return instance._state.db
+    if instance._meta.model_name == 'sentence':
+        if not instance._meta.get_field('article').is_cached(instance):
+            return None
+        instance = instance.article  # sentences may be by others than the author
+        if instance._state.db:
+            return instance._state.db
+    return for_author(instance.author_id) if instance.author_id is not None else None
+
+
+class ShardRouter(object):
+    ''' Sends articles and sentences to their shard. Leaves queries it has
+        no instance for, and other apps, to the next router. '''
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != LABEL or not aliases():
+            return None
+        instance = hints.get('instance')
+        return for_instance(instance) if instance is not None else None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        ''' Users live on 'default', their articles on a shard. '''
+        if LABEL in (obj1._meta.app_label, obj2._meta.app_label) and aliases():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = aliases()
+        if not shards:
+            return None
+        if app_label == LABEL:
+            return db in shards
+        if db in shards and db != 'default':
+            return False  # shards only hold articles
+        return None
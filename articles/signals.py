@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent by Article methods that write sentences in bulk (bulk_create,
+# queryset updates), which do not send post_save / post_delete.
+# `created` lists the sentences inserted in bulk, `updated` those whose
+# text was rewritten in bulk, if any, and `renumbered` how numbers
+# changed: {'op': 'shift', 'from': num, 'by': delta} for the sentences
+# from `num` on, {'op': 'move', 'from': num, 'to': num} for a moved
+# sentence and those in between, {'op': 'reorder', 'order': [num, ...]}.
+sentences_changed = Signal(providing_args=['article', 'created', 'updated', 'renumbered'])
@@ -0,0 +1,107 @@
+''' Delta sync of an author's articles, sentences and deletions.
+    A sync run walks three streams in turn, each in (timestamp, id) order
+    so that pages are keyset seeks on the (author, timestamp, id) indexes:
+    the articles and the sentences modified after the cursor, by their
+    mod_date, and the tombstones logged after it. Renumbering touches
+    mod_date, so sentences shifted by a delete come back as changes.
+    The run is bounded by the time it started, changes made meanwhile go
+    to the next run, whose cursor starts ARTICLES['SYNC_OVERLAP'] seconds
+    earlier to catch rows committed after being timestamped; clients apply
+    changes by id, so receiving one twice is harmless. '''
+import base64
+import datetime
+import json
+from collections import namedtuple
+from django.db.models import Q
+from django.utils import dateparse, timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from articles import conf
+from articles.models import Article, Sentence, Tombstone
+
+# name, queryset, timestamp field
+STREAMS = (
+    ('articles', lambda author: Article.objects.for_author(author), 'mod_date'),
+    ('sentences', lambda author: Sentence.objects.for_author(author).filter(author=author)
+     .select_related('article'), 'mod_date'),  # written by their article's author
+    ('deleted', lambda author: Tombstone.objects.for_author(author), 'deleted_at'),
+)
+
+
+class Cursor(namedtuple('Cursor', 'since until stream after')):
+    ''' Position of a sync run: changes after `since` up to `until`, next
+        from stream number `stream`, after the (timestamp, id) `after`. '''
+
+    def encode(self):
+        raw = json.dumps([None if value is None else str(value)
+                          for value in (self.since, self.until)] +
+                         [self.stream, self.after and [str(value) for value in self.after]])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode(cls, encoded):
+        ''' Raises ValueError on a malformed cursor. '''
+        try:
+            since, until, stream, after = json.loads(
+                base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            since, until = [None if value is None else parse(value) for value in (since, until)]
+            if since is None and until is None or not 0 <= stream < len(STREAMS) or \
+                    after is not None and len(after) != 2:
+                raise ValueError
+            return cls(since, until, stream, after and (parse(after[0]), after[1]))
+        except Exception:
+            raise ValueError('Invalid cursor')
+
+
+def parse(value):
+    result = dateparse.parse_datetime(value)
+    if result is None:
+        raise ValueError(value)
+    return result
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor older than the deletion log, sync from the start.'
+    default_code = 'cursor_expired'
+
+
+def start(since=None):
+    ''' The cursor of a sync run from the cursor returned by the previous
+        run (`since` encoded), or from the start. '''
+    if since is None:
+        return Cursor(None, timezone.now(), 0, None)
+    try:
+        cursor = Cursor.decode(since)
+    except ValueError:
+        raise NotFound('Invalid cursor')
+    if cursor.until is not None:  # a page of a run in progress
+        return cursor
+    if cursor.since < timezone.now() - datetime.timedelta(days=conf.get('TOMBSTONE_DAYS')):
+        raise CursorExpired()
+    return cursor._replace(until=timezone.now())
+
+
+def changes(author_id, cursor, limit):
+    ''' Up to `limit` changes of `author_id` from `cursor`.
+        Returns ({stream name: rows}, next cursor, whether the run has more). '''
+    result = {name: [] for name, _, _ in STREAMS}
+    after = cursor.after
+    for number in range(cursor.stream, len(STREAMS)):
+        name, queryset, field = STREAMS[number]
+        window = Q(**{field + '__lte': cursor.until})
+        if cursor.since is not None:
+            window &= Q(**{field + '__gt': cursor.since})
+        if after is not None:
+            window &= Q(**{field + '__gt': after[0]}) | Q(**{field: after[0], 'pk__gt': after[1]})
+        rows = list(queryset(author_id).filter(window).order_by(field, 'pk')[:limit + 1])
+        if len(rows) > limit:
+            rows = result[name] = rows[:limit]
+            if rows:
+                after = (getattr(rows[-1], field), rows[-1].pk)
+            return result, cursor._replace(stream=number, after=after), True
+        result[name] = rows
+        limit -= len(rows)
+        after = None
+    overlap = datetime.timedelta(seconds=conf.get('SYNC_OVERLAP'))
+    return result, Cursor(cursor.until - overlap, None, 0, None), False
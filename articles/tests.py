@@ -1,9 +1,29 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from unittest import mock
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework import status
 from django.contrib.auth.models import User
-from rest_framework_jwt.views import obtain_jwt_token, verify_jwt_token
-from rest_framework.test import APITestCase
+from rest_framework_jwt.settings import api_settings as jwt_settings
+from rest_framework_jwt.views import obtain_jwt_token, refresh_jwt_token, verify_jwt_token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from articles import cache, events, search, shards, sync
 from articles.models import *
+from articles.management.commands import bench
+from articles.management.commands.convert_int_pks import BASELINE_SCHEMA, UUID_SCHEMA
+from config import sqlite
 
 class ArticleViewSetTest(APITestCase):
     def setUp(self):
@@ -64,6 +84,33 @@ class ArticleViewSetTest(APITestCase):
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
         self.assertEqual(resp.data['title'], 'New Test Article')
 
+    def test_post_article_with_sentences(self):
+        '''
+        Test POST /articles/ with a nested sentences array
+        Should create the article and its sentences numbered from 1 in one request
+        '''
+        url = reverse('articles-list')
+        self.client.force_authenticate(self.user)
+        texts = ['Sentence %d.' % i for i in range(100)]
+        data = {'title':'New Test Article', 'sentences':texts[:50] + [{'text':t} for t in texts[50:]]}
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post(url, data)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.data['sentences'], texts)
+        self.assertEqual(resp.data['sentence_count'], 100)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "articles_sentence"')]
+        self.assertEqual(len(inserts), 1)
+        article = Article.objects.get(uuid=resp.data['id'])
+        self.assertEqual(list(article.sentences.values_list('num', 'text')),
+                         list(zip(range(1, 101), texts)))
+
+        # invalid sentences, nothing is written
+        for sentences in (['ok', ''], 'not a list', [{'text':None}]):
+            resp = self.client.post(url, {'title':'Invalid', 'sentences':sentences})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('sentences', resp.data)
+        self.assertFalse(Article.objects.filter(title='Invalid').exists())
+
     def test_get_article(self):
         '''
         Test GET /article/<pk>/
@@ -76,8 +123,8 @@ class ArticleViewSetTest(APITestCase):
         other_article = Article.objects.create(title='Test Article (other)',
                                             author=self.other_user)
 
-        url = reverse('articles-detail', kwargs={'pk':article.id})
-        other_url = reverse('articles-detail', kwargs={'pk':other_article.id})
+        url = reverse('articles-detail', kwargs={'pk':article.uuid})
+        other_url = reverse('articles-detail', kwargs={'pk':other_article.uuid})
 
          # unathorized
         resp = self.client.get(url)
@@ -92,7 +139,7 @@ class ArticleViewSetTest(APITestCase):
         self.client.login(username='testuser', password='pass')
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        self.assertEqual(resp.data['id'].replace('-',''), article.id.hex)
+        self.assertEqual(resp.data['id'].replace('-',''), article.uuid.hex)
         self.assertEqual(resp.data['title'], 'Test Article')
         self.assertEqual(resp.data['author'], self.user.id)
 
@@ -108,8 +155,8 @@ class ArticleViewSetTest(APITestCase):
         other_article = Article.objects.create(title='Test Article (other)',
                                             author=self.other_user)
 
-        url = reverse('articles-detail', kwargs={'pk':article.id})
-        other_url = reverse('articles-detail', kwargs={'pk':other_article.id})
+        url = reverse('articles-detail', kwargs={'pk':article.uuid})
+        other_url = reverse('articles-detail', kwargs={'pk':other_article.uuid})
 
          # unathorized
         resp = self.client.put(url, {'title':'Changed Test Article'})
@@ -124,7 +171,7 @@ class ArticleViewSetTest(APITestCase):
         self.client.login(username='testuser', password='pass')
         resp = self.client.put(url, {'title':'Changed Test Article'})
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        self.assertEqual(resp.data['id'].replace('-',''), article.id.hex)
+        self.assertEqual(resp.data['id'].replace('-',''), article.uuid.hex)
         self.assertEqual(resp.data['title'], 'Changed Test Article')
         self.assertEqual(resp.data['author'], self.user.id)
 
@@ -140,8 +187,8 @@ class ArticleViewSetTest(APITestCase):
         other_article = Article.objects.create(title='Test Article (other)',
                                             author=self.other_user)
 
-        url = reverse('articles-detail', kwargs={'pk':article.id})
-        other_url = reverse('articles-detail', kwargs={'pk':other_article.id})
+        url = reverse('articles-detail', kwargs={'pk':article.uuid})
+        other_url = reverse('articles-detail', kwargs={'pk':other_article.uuid})
 
          # unathorized
         resp = self.client.delete(url)
@@ -171,8 +218,8 @@ class ArticleViewSetTest(APITestCase):
         other_sentence = Sentence.objects.create(article=other_article,
                                             author=self.other_user)
 
-        url = reverse('articles-sentences', kwargs={'pk':article.id})
-        other_url = reverse('articles-sentences', kwargs={'pk':other_article.id})
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        other_url = reverse('articles-sentences', kwargs={'pk':other_article.uuid})
 
          # unathorized
         resp = self.client.get(url)
@@ -188,7 +235,7 @@ class ArticleViewSetTest(APITestCase):
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(len(resp.data), 1)
-        self.assertEqual(resp.data[0]['article'].hex.replace('-',''), article.id.hex)
+        self.assertEqual(resp.data[0]['article'].hex.replace('-',''), article.uuid.hex)
 
     def test_post_article_sentence(self):
         '''
@@ -201,8 +248,8 @@ class ArticleViewSetTest(APITestCase):
         other_article = Article.objects.create(title='Test Article (other)',
                                             author=self.other_user)
 
-        url = reverse('articles-sentences', kwargs={'pk':article.id})
-        other_url = reverse('articles-sentences', kwargs={'pk':other_article.id})
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        other_url = reverse('articles-sentences', kwargs={'pk':other_article.uuid})
 
          # unathorized
         resp = self.client.post(url, {'text':'Test sentence'})
@@ -218,10 +265,53 @@ class ArticleViewSetTest(APITestCase):
         for i in range(1,6):
             resp = self.client.post(url, {'text':'Test sentence'})
             self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
-            self.assertEqual(resp.data['article'], article.id)
+            self.assertEqual(resp.data['article'], article.uuid)
             self.assertEqual(resp.data['num'], i)
             self.assertEqual(resp.data['text'], 'Test sentence')
 
+    def test_post_article_sentences_bulk(self):
+        '''
+        Test POST /article/<pk>/sentences/ with a list of sentences
+        Should return new sentences with consecutive numbers and 201 CREATED
+        '''
+        article = Article.objects.create(title='Test Article', author=self.user)
+        Sentence.objects.create(article=article, author=self.user, text='first')
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        self.client.login(username='testuser', password='pass')
+
+        # JSON list of strings and objects
+        resp = self.client.post(url, ['second', {'text':'third'}])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([s['num'] for s in resp.data], [2, 3])
+        self.assertEqual([s['text'] for s in resp.data], ['second', 'third'])
+
+        # newline-delimited plain text
+        resp = self.client.post(url, 'fourth\n\nfifth\n', content_type='text/plain')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([s['num'] for s in resp.data], [4, 5])
+
+        # a single batched insert
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post(url, ['text'] * 100)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(article.sentences.count(), 105)
+        self.assertEqual(article.sentences.last().num, 105)
+
+        # invalid payloads
+        resp = self.client.post(url, [])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, ['ok', ''])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, {})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, {'text': 5})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, {'text': ['a']})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(article.sentences.count(), 105)
+
     def test_get_article_sentence(self):
         '''
         Test GET /article/<pk>/sentences/<sentence_num>/
@@ -235,9 +325,9 @@ class ArticleViewSetTest(APITestCase):
         sentence = Sentence.objects.create(article=article, author=self.user, text='test')
         other_sentence = Sentence.objects.create(article=other_article,
                                                 author=self.other_user)
-        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.id,
+        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
                                                     'sentence_num':sentence.num})
-        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.id,
+        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.uuid,
                                                     'sentence_num':other_sentence.num})
 
          # unathorized
@@ -253,7 +343,7 @@ class ArticleViewSetTest(APITestCase):
         self.client.login(username='testuser', password='pass')
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        self.assertEqual(resp.data['article'], article.id)
+        self.assertEqual(resp.data['article'], article.uuid)
         self.assertEqual(resp.data['num'], 1)
         self.assertEqual(resp.data['text'], 'test')
 
@@ -268,9 +358,9 @@ class ArticleViewSetTest(APITestCase):
         sentence = Sentence.objects.create(article=article, author=self.user, text='test')
         other_sentence = Sentence.objects.create(article=other_article,
                                                 author=self.other_user)
-        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.id,
+        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
                                                     'sentence_num':sentence.num})
-        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.id,
+        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.uuid,
                                                     'sentence_num':other_sentence.num})
 
          # unathorized
@@ -286,7 +376,7 @@ class ArticleViewSetTest(APITestCase):
         self.client.login(username='testuser', password='pass')
         resp = self.client.put(url, {'text':'updated text'})
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        self.assertEqual(resp.data['article'], article.id)
+        self.assertEqual(resp.data['article'], article.uuid)
         self.assertEqual(resp.data['num'], 1)
         self.assertEqual(resp.data['text'], 'updated text')
 
@@ -301,9 +391,9 @@ class ArticleViewSetTest(APITestCase):
         sentence = Sentence.objects.create(article=article, author=self.user, text='test')
         other_sentence = Sentence.objects.create(article=other_article,
                                                 author=self.other_user)
-        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.id,
+        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
                                                     'sentence_num':sentence.num})
-        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.id,
+        other_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':other_article.uuid,
                                                     'sentence_num':other_sentence.num})
 
          # unathorized
@@ -319,3 +409,1254 @@ class ArticleViewSetTest(APITestCase):
         self.client.login(username='testuser', password='pass')
         resp = self.client.delete(url)
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_delete_article_sentence_renumbers(self):
+        '''
+        Test DELETE /article/<pk>/sentences/<sentence_num>/
+        Should shift following sentences down with a constant number of queries
+        '''
+        self.client.login(username='testuser', password='pass')
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['one', 'two', 'three', 'four'], author=self.user)
+        url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
+                                                    'sentence_num':2})
+        resp = self.client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(article.sentences.values_list('num', 'text')),
+                         [(1, 'one'), (2, 'three'), (3, 'four')])
+
+        # same number of queries for a short and a long article
+        long_article = Article.objects.create(title='Long Article', author=self.user)
+        long_article.append_sentences(['text'] * 1000, author=self.user)
+        with CaptureQueriesContext(connection) as short_queries:
+            article.delete_sentence(article.sentences.get(num=1))
+        with CaptureQueriesContext(connection) as long_queries:
+            long_article.delete_sentence(long_article.sentences.get(num=1))
+        self.assertEqual(len(short_queries), len(long_queries))
+        self.assertEqual(long_article.sentences.last().num, 999)
+
+        # gap mode leaves the numbers untouched
+        with self.settings(ARTICLES={'SENTENCE_GAPS': True}):
+            resp = self.client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(article.sentences.values_list('num', flat=True)), [1])
+
+        # a delete without gaps closes the ones left in gap mode
+        gapped = Article.objects.create(title='Gapped Article', author=self.user)
+        gapped.append_sentences(['one', 'two', 'three', 'four', 'five', 'six'], author=self.user)
+        with self.settings(ARTICLES={'SENTENCE_GAPS': True}):
+            for num in (2, 4, 6):
+                gapped.delete_sentence(gapped.sentences.get(num=num))
+        self.assertEqual(list(gapped.sentences.values_list('num', flat=True)), [1, 3, 5])
+        gapped.delete_sentence(gapped.sentences.get(num=1))
+        self.assertEqual(list(gapped.sentences.values_list('num', 'text')),
+                         [(1, 'three'), (2, 'five')])
+        gapped.append_sentences(['seven'], author=self.user)
+        self.assertEqual(list(gapped.sentences.values_list('num', flat=True)), [1, 2, 3])
+
+        # or all at once
+        with self.settings(ARTICLES={'SENTENCE_GAPS': True}):
+            gapped.delete_sentence(gapped.sentences.get(num=1))
+            gapped.delete_sentence(gapped.sentences.get(num=3))
+        out = io.StringIO()
+        call_command('compact_sentences', stdout=out)
+        self.assertIn('2 compacted', out.getvalue())  # and the first article
+        self.assertEqual(list(gapped.sentences.values_list('num', 'text')), [(1, 'five')])
+        self.assertEqual(list(article.sentences.values_list('num', flat=True)), [1])
+        gapped.refresh_from_db()
+        self.assertEqual(gapped.last_num, 1)
+
+    def test_get_articles_fields_and_expand(self):
+        '''
+        Test GET /articles/?fields=...&expand=sentences
+        Should return the selected fields with a constant number of queries
+        '''
+        url = reverse('articles-list')
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['one', 'two'], author=self.user)
+        Article.objects.create(title='Empty Article', author=self.user)
+
+        # metadata and a sentence count only by default
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn('sentences', resp.data[0])
+        self.assertEqual([a['sentence_count'] for a in resp.data], [2, 0])
+
+        resp = self.client.get(url, {'fields':'id,title'})
+        self.assertEqual(set(resp.data[0]), {'id', 'title'})
+
+        resp = self.client.get(url, {'expand':'sentences'})
+        self.assertEqual(resp.data[0]['sentences'], ['one', 'two'])
+
+        # the number of queries does not depend on the number of articles
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url, {'expand':'sentences'})
+        for i in range(10):
+            other = Article.objects.create(title='Article %d' % i, author=self.user)
+            other.append_sentences(['text'] * 3, author=self.user)
+        with CaptureQueriesContext(connection) as many:
+            resp = self.client.get(url, {'expand':'sentences'})
+        self.assertEqual(len(resp.data), 12)
+        self.assertEqual(len(few), len(many))
+
+    def test_conditional_get(self):
+        '''
+        Test GET with If-None-Match / If-Modified-Since
+        Should return 304 Not Modified until the article or a sentence changes
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['one', 'two'], author=self.user)
+        article_url = reverse('articles-detail', kwargs={'pk':article.uuid})
+        list_url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        detail_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
+                                                            'sentence_num':1})
+
+        for url in (article_url, list_url, detail_url):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.client.get(detail_url)
+        resp = self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a sentence change invalidates the article and list validators
+        etags = [self.client.get(url)['ETag'] for url in (article_url, list_url)]
+        self.client.put(detail_url, {'text':'changed'})
+        for url, etag in zip((article_url, list_url), etags):
+            resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # so do deletes, which leave no sentence behind, with or without gaps
+        for gaps in (False, True):
+            past = timezone.now() - timedelta(hours=1)  # Last-Modified has 1 s resolution
+            Article.objects.filter(pk=article.pk).update(mod_date=past)
+            article.sentences.update(mod_date=past)
+            last_modified = self.client.get(list_url)['Last-Modified']
+            with self.settings(ARTICLES=dict(settings.ARTICLES, SENTENCE_GAPS=gaps)):
+                article.delete_sentence(article.sentences.last())
+            resp = self.client.get(list_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(resp.data), 1 - gaps)
+
+        # other users never get validators for foreign articles
+        self.client.force_authenticate(self.other_user)
+        resp = self.client.get(article_url, HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_payloads(self):
+        '''
+        Test repeated GET /articles/<pk>/ and /articles/<pk>/sentences/
+        Should be served from the cache until a write invalidates the article
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['one', 'two', 'three'], author=self.user)
+        article_url = reverse('articles-detail', kwargs={'pk':article.uuid})
+        list_url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        detail_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
+                                                            'sentence_num':1})
+
+        def get(url, expected):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp['X-Cache'], expected)
+            return resp.data
+
+        hits = cache.stats()['hits']
+        get(list_url, 'miss')
+        get(article_url, 'miss')
+        self.assertEqual(get(list_url, 'hit')[0]['text'], 'one')
+        self.assertEqual(get(article_url, 'hit')['sentences'], ['one', 'two', 'three'])
+        self.assertEqual(cache.stats()['hits'], hits + 2)
+
+        # Sentence save
+        self.client.put(detail_url, {'text':'changed'})
+        self.assertEqual(get(list_url, 'miss')[0]['text'], 'changed')
+        self.assertEqual(get(article_url, 'miss')['sentences'][0], 'changed')
+
+        # delete with bulk renumber
+        self.client.delete(detail_url)
+        self.assertEqual([s['num'] for s in get(list_url, 'miss')], [1, 2])
+
+        # bulk append
+        self.client.post(list_url, ['four'])
+        self.assertEqual(len(get(list_url, 'miss')), 3)
+
+        # Article save
+        self.client.put(article_url, {'title':'Changed'})
+        self.assertEqual(get(article_url, 'miss')['title'], 'Changed')
+
+        # a write committed while a payload is built orphans it
+        store = cache.store
+        def invalidated_store(key, value):
+            cache.invalidate(article.uuid)
+            store(key, value)
+        with mock.patch('articles.cache.store', invalidated_store):
+            get(list_url, 'miss')
+        get(list_url, 'miss')
+        get(list_url, 'hit')
+
+        # other users are not served cached payloads
+        self.client.force_authenticate(self.other_user)
+        self.assertEqual(self.client.get(article_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(list_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_article(self):
+        '''
+        Test GET /articles/<pk>/export/?format=ndjson|text
+        Should stream all sentences in num order
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['sentence %d' % i for i in range(1, 1201)], author=self.user)
+        other_article = Article.objects.create(title='Test Article (other)',
+                                               author=self.other_user)
+        url = reverse('articles-export', kwargs={'pk':article.uuid})
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.streaming)
+        self.assertTrue(resp['Content-Type'].startswith('application/x-ndjson'))
+        lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 1200)
+        self.assertEqual(json.loads(lines[0]), {'num':1, 'text':'sentence 1'})
+        self.assertEqual(json.loads(lines[-1])['num'], 1200)
+
+        resp = self.client.get(url, {'format':'text'})
+        self.assertTrue(resp['Content-Type'].startswith('text/plain'))
+        text = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEqual(text.splitlines()[:2], ['sentence 1', 'sentence 2'])
+
+        # one line per sentence, whatever line breaks the texts contain
+        Sentence.objects.filter(article=article, num=1).update(text='one\ntwo\r\nthree\u2028four')
+        resp = self.client.get(url, {'format':'text'})
+        text = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEqual(len(text.splitlines()), 1200)
+        self.assertEqual(text.splitlines()[0], 'one two three four')
+
+        resp = self.client.get(reverse('articles-export', kwargs={'pk':other_article.uuid}))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_articles(self):
+        '''
+        Test GET /articles/search/?q=<phrase>
+        Should return the user's matching articles, ranked, with sentence numbers
+        '''
+        self.client.force_authenticate(self.user)
+        url = reverse('articles-search')
+        article = Article.objects.create(title='Quick', author=self.user)
+        article.append_sentences(['The quick brown fox.', 'A lazy dog.',
+                                  'Quick brown foxes again.'], author=self.user)
+        other = Article.objects.create(title='Brown', author=self.user)
+        other.append_sentences(['Brown fox and a quick brown fox and another brown fox.'],
+                               author=self.user)
+        foreign = Article.objects.create(title='Foreign', author=self.other_user)
+        foreign.append_sentences(['brown fox'], author=self.other_user)
+
+        resp = self.client.get(url, {'q':'brown fox'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['article'] for r in resp.data], [other.uuid, article.uuid])
+        self.assertEqual(resp.data[1]['sentences'], [1])
+
+        # phrase, not words
+        resp = self.client.get(url, {'q':'fox brown'})
+        self.assertEqual(resp.data, [])
+
+        # index follows updates, deletes and bulk appends
+        detail_url = reverse('articles-sentences/(?P<sentence-num>\d+)', kwargs={'pk':article.uuid,
+                                                            'sentence_num':2})
+        self.client.put(detail_url, {'text':'A lazy brown fox.'})
+        self.assertEqual(self.client.get(url, {'q':'lazy brown'}).data[0]['sentences'], [2])
+        other.delete_sentence(other.sentences.get(num=1))
+        self.client.post(reverse('articles-sentences', kwargs={'pk':article.uuid}), ['brown fox'])
+        resp = self.client.get(url, {'q':'brown fox'})
+        self.assertEqual([r['article'] for r in resp.data], [article.uuid])
+        self.assertEqual(resp.data[0]['sentences'], [1, 2, 4])
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_memory_index(self):
+        '''
+        Test the pure-Python search fallback
+        Should match phrases within the user's articles and follow changes
+        '''
+        article = Article.objects.create(title='Quick', author=self.user)
+        article.append_sentences(['The quick brown fox.', 'A lazy dog.'], author=self.user)
+        foreign = Article.objects.create(title='Foreign', author=self.other_user)
+        foreign.append_sentences(['brown fox'], author=self.other_user)
+        index = search.MemoryIndex('default')
+
+        results = index.search(self.user.id, 'Brown  FOX', 10)
+        self.assertEqual([(r['article'], r['sentences']) for r in results], [(article.uuid, [1])])
+        self.assertEqual(index.search(self.user.id, 'fox brown', 10), [])
+
+        sentence = article.sentences.get(num=2)
+        sentence.text = 'A lazy brown fox.'
+        index.add([sentence])
+        sentence.save()
+        self.assertEqual(index.search(self.user.id, 'brown fox', 10)[0]['sentences'], [1, 2])
+        index.remove(sentence)
+        self.assertEqual(index.search(self.user.id, 'lazy', 10), [])
+
+        # other users' matches do not count against the limit
+        foreign.append_sentences(['brown fox'] * (search.MAX_MATCHES + 500), author=self.other_user)
+        newer = Article.objects.create(title='Newer', author=self.user)
+        newer.append_sentences(['brown fox'], author=self.user)
+        results = search.MemoryIndex('default').search(self.user.id, 'brown fox', 10)
+        self.assertEqual({r['article'] for r in results}, {article.uuid, newer.uuid})
+
+    def test_sentence_not_found(self):
+        '''
+        Test GET /article/<pk>/sentences/<num>/ for unreachable sentences
+        Should return the same 404 for missing and foreign rows, in one query
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['text'], author=self.user)
+        other_article = Article.objects.create(title='Test Article (another)',
+                                               author=self.other_user)
+        other_article.append_sentences(['text'], author=self.other_user)
+        name = 'articles-sentences/(?P<sentence-num>\d+)'
+        urls = [reverse(name, kwargs={'pk':other_article.uuid, 'sentence_num':1}),
+                reverse(name, kwargs={'pk':article.uuid, 'sentence_num':2}),
+                reverse(name, kwargs={'pk':uuid.uuid4(), 'sentence_num':1})]
+        responses = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                responses.append(self.client.put(url, {'text':'changed'}))
+            self.assertEqual(len(queries), 1)
+        self.assertEqual({r.status_code for r in responses}, {status.HTTP_404_NOT_FOUND})
+        self.assertEqual(len({r.content for r in responses}), 1)
+
+    def test_patch_sentence(self):
+        '''
+        Test PATCH /article/<pk>/sentences/<num>/
+        Should write only changed columns, skip unchanged writes and ignore read-only fields
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        sentence = article.append_sentences(['text', 'other'], author=self.user)[0]
+        url = reverse('articles-sentences/(?P<sentence-num>\d+)',
+                      kwargs={'pk':article.uuid, 'sentence_num':1})
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.patch(url, {'text':'changed', 'num':2, 'author':self.other_user.id})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual((resp.data['text'], resp.data['num']), ('changed', 1))
+        self.assertGreater(resp.data['mod_date'], resp.data['pub_date'])
+        update, = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertTrue(update.startswith('UPDATE "articles_sentence" SET "text" = '))
+        self.assertNotIn('"num"', update)
+        sentence.refresh_from_db()
+        self.assertEqual((sentence.text, sentence.num, sentence.author), ('changed', 1, self.user))
+
+        # unchanged, nothing is written
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.patch(url, {'text':'changed'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+
+        resp = self.client.patch(url, {'text':''})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_update_sentences(self):
+        '''
+        Test PATCH /article/<pk>/sentences/
+        Should update many sentences in one transaction, or none on any invalid item
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences([str(i) for i in range(1, 1001)], author=self.user)
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+
+        data = [{'num':num, 'text':'changed %d' % num} for num in range(1000, 1, -2)]
+        data.append({'num':1, 'text':'1'})  # unchanged
+        resp = self.client.patch(url, data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['num'] for s in resp.data], [item['num'] for item in data])
+        texts = dict(article.sentences.values_list('num', 'text'))
+        self.assertEqual(texts[1000], 'changed 1000')
+        self.assertEqual(texts[999], '999')
+        self.assertEqual(texts[1], '1')
+
+        for data in ([{'num':1, 'text':'a'}, {'num':1001, 'text':'b'}],
+                     [{'num':1, 'text':'a'}, {'num':1, 'text':'b'}],
+                     [{'num':1, 'text':'a'}, {'num':2, 'text':''}],
+                     [], {'num':1, 'text':'a'}):
+            resp = self.client.patch(url, data)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(article.sentences.get(num=1).text, '1')
+
+    def test_move_sentence(self):
+        '''
+        Test POST /article/<pk>/sentences/<num>/move/
+        Should move the sentence to {"to": ...}, shift the range between with constant queries
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        sentences = article.append_sentences([str(i) for i in range(1, 101)], author=self.user)
+        texts = lambda: list(article.sentences.values_list('text', flat=True))
+        move = lambda num, to: self.client.post(
+            reverse('articles-sentence-move', kwargs={'pk':article.uuid, 'sentence_num':num}),
+            {'to':to})
+
+        counts = []
+        for num, to, expected in ((2, 4, ['1', '3', '4', '2', '5']),
+                                  (4, 1, ['2', '1', '3', '4', '5']),
+                                  (1, 100, ['1', '3', '4', '5', '6'])):
+            with CaptureQueriesContext(connection) as queries:
+                resp = move(num, to)
+            counts.append(len(queries))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.data['num'], to)
+            self.assertEqual(texts()[:5], expected)
+        self.assertEqual(len(set(counts)), 1)
+        self.assertEqual(texts()[-1], '2')
+        moved = article.sentences.get(num=100)
+        self.assertEqual((moved.id, moved.pub_date), (sentences[1].id, sentences[1].pub_date))
+
+        for to in (0, 101, 'x'):
+            self.assertEqual(move(1, to).status_code, status.HTTP_400_BAD_REQUEST)
+        other_article = Article.objects.create(title='Test Article (another)',
+                                               author=self.other_user)
+        other_article.append_sentences(['1', '2'], author=self.other_user)
+        resp = self.client.post(reverse('articles-sentence-move',
+                                        kwargs={'pk':other_article.uuid, 'sentence_num':1}), {'to':2})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reorder_sentences(self):
+        '''
+        Test POST /article/<pk>/sentences/reorder/
+        Should renumber all sentences from a permutation in one transaction
+        '''
+        self.client.force_authenticate(self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences([str(i) for i in range(1, 1001)], author=self.user)
+        url = reverse('articles-sentence-reorder', kwargs={'pk':article.uuid})
+        order = list(range(1000, 0, -1))
+        resp = self.client.post(url, {'order':order})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(article.sentences.values_list('text', flat=True)),
+                         [str(i) for i in order])
+
+        for order in (list(range(1, 1000)), [1] * 1000, 'x', None):
+            resp = self.client.post(url, {'order':order})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(article.sentences.first().text, '1000')
+
+
+class ConcurrentAppendTest(TransactionTestCase):
+    THREADS = 8
+    REQUESTS = 50  # per thread, alternating single and batched appends
+    BATCH = 9
+
+    def test_concurrent_appends(self):
+        '''
+        Test parallel POST /article/<pk>/sentences/
+        Should allocate distinct, gap-free sentence numbers without errors
+        '''
+        user = User.objects.create_user(username='testuser', password='pass')
+        article = Article.objects.create(title='Test Article', author=user)
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        errors = []
+
+        def append():
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for i in range(self.REQUESTS):
+                    data = {'text':'single'} if i % 2 else ['batch'] * self.BATCH
+                    resp = client.post(url, data)
+                    if resp.status_code != status.HTTP_201_CREATED:
+                        errors.append(resp.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=append) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.THREADS * self.REQUESTS // 2 * (self.BATCH + 1)
+        nums = list(article.sentences.values_list('num', flat=True))
+        self.assertEqual(nums, list(range(1, total + 1)))
+        article.refresh_from_db()
+        self.assertEqual(article.last_num, total)
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.login(username='testuser', password='pass')
+
+    def follow(self, url):
+        ''' Collect all pages by following Link headers. '''
+        pages = []
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages.append(resp.data)
+            url = resp.get('Link', '').partition(';')[0].strip('<>') or None
+        return pages
+
+    def test_articles_pages(self):
+        '''
+        Test GET /articles/?page_size=<n>
+        Should return every article once, in (pub_date, id) order
+        '''
+        articles = [Article.objects.create(title='Article %d' % i, author=self.user)
+                    for i in range(5)]
+        pages = self.follow(reverse('articles-list') + '?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        ids = [a['id'] for page in pages for a in page]
+        expected = sorted(articles, key=lambda a: (a.pub_date, a.id))
+        self.assertEqual(ids, [str(a.uuid) for a in expected])
+
+    def test_sentences_pages(self):
+        '''
+        Test GET /articles/<pk>/sentences/?page_size=<n>
+        Should return every sentence once, in num order, with constant queries per page
+        '''
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['text'] * 7, author=self.user)
+        url = reverse('articles-sentences', kwargs={'pk':article.uuid}) + '?page_size=3'
+        pages = self.follow(url)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([s['num'] for page in pages for s in page], list(range(1, 8)))
+
+        resp = self.client.get(url + '&cursor=bogus')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryBudgetTest(APITestCase):
+    ''' Every route runs a fixed number of queries, whatever the data size. '''
+    BUDGETS = {  # statements per request, savepoints included
+        'article_list': 1,
+        'article_create': 1,
+        'article_detail': 3,
+        'article_update': 4,
+        'article_delete': 7,
+        'sentence_list': 2,
+        'sentence_batch_update': 7,
+        'sentence_reorder': 7,
+        'sentence_append': 8,
+        'sentence_detail': 2,
+        'sentence_update': 3,
+        'sentence_move': 10,
+        'sentence_delete': 11,
+        'export': 2,
+        'search': 1,
+        'sync': 3,
+        'token_obtain': 1,
+        'token_verify': 1,
+        'token_refresh': 1,
+    }
+    SIZES = (3, 300)  # sentences in the target article and batches; as many other articles
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def populate(self, size):
+        for i in range(size):
+            Article.objects.create(title='Other %d' % i, author=self.user)
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['brown fox %d' % i for i in range(size)], author=self.user)
+        return article
+
+    def requests(self, article, size):
+        token = jwt_settings.JWT_ENCODE_HANDLER(jwt_settings.JWT_PAYLOAD_HANDLER(self.user))
+        detail = reverse('articles-detail', kwargs={'pk':article.uuid})
+        sentences = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        sentence = reverse('articles-sentences/(?P<sentence-num>\d+)',
+                           kwargs={'pk':article.uuid, 'sentence_num':2})
+        return [
+            ('article_list', 'get', reverse('articles-list'), None),
+            ('article_create', 'post', reverse('articles-list'), {'title':'New'}),
+            ('article_detail', 'get', detail, None),
+            ('article_update', 'put', detail, {'title':'Renamed'}),
+            ('sentence_list', 'get', sentences, None),
+            ('sentence_batch_update', 'patch', sentences,  # all of them, as many as SIZES
+             [{'num':i, 'text':'brown fox, %d' % i} for i in range(1, size + 1)]),
+            ('sentence_reorder', 'post', reverse('articles-sentence-reorder',
+                                                 kwargs={'pk':article.uuid}),
+             {'order':list(range(size, 0, -1))}),
+            ('sentence_append', 'post', sentences, ['one', 'two']),
+            ('sentence_detail', 'get', sentence, None),
+            ('sentence_update', 'put', sentence, {'text':'Changed'}),
+            ('sentence_move', 'post', reverse('articles-sentence-move',
+                                              kwargs={'pk':article.uuid, 'sentence_num':1}), {'to':3}),
+            ('sentence_delete', 'delete', sentence, None),
+            ('export', 'get', reverse('articles-export', kwargs={'pk':article.uuid}), None),
+            ('search', 'get', reverse('articles-search') + '?q=brown+fox', None),
+            ('sync', 'get', reverse('sync') + '?page_size=1000', None),  # every stream, one page
+            ('article_delete', 'delete', detail, None),
+            ('token_obtain', 'post', reverse(obtain_jwt_token),
+             {'username':'testuser', 'password':'pass'}),
+            ('token_verify', 'post', reverse(verify_jwt_token), {'token':token}),
+            ('token_refresh', 'post', reverse(refresh_jwt_token), {'token':token}),
+        ]
+
+    def count_queries(self, size):
+        counts = {}
+        article = self.populate(size)
+        with self.settings(ARTICLES={'CACHE': None}):
+            for name, method, url, data in self.requests(article, size):
+                with CaptureQueriesContext(connection) as queries:
+                    resp = getattr(self.client, method)(url, data, format='json')
+                    if resp.streaming:
+                        b''.join(resp.streaming_content)
+                self.assertLess(resp.status_code, 300, name)
+                counts[name] = len(queries)
+        return counts
+
+    def test_query_budgets(self):
+        '''
+        Test every route at two data sizes
+        Should stay within its query budget, independently of the data size
+        '''
+        small, large = [self.count_queries(size) for size in self.SIZES]
+        self.assertEqual(small, large)
+        self.assertEqual(set(large), set(self.BUDGETS))
+        for name, budget in self.BUDGETS.items():
+            self.assertLessEqual(large[name], budget, name)
+
+
+class ArticleStatisticsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def stats(self, article):
+        article.refresh_from_db()
+        return article.sentence_count, article.word_count
+
+    def check(self):
+        call_command('rebuild_article_stats', check=True, stdout=io.StringIO())
+
+    def test_statistics_maintained(self):
+        '''
+        Test sentence_count, word_count and last_sentence_at through every write path
+        Should match the sentences after each write
+        '''
+        resp = self.client.post(reverse('articles-list'),
+                                {'title':'Test Article', 'sentences':['one two', 'three']})
+        self.assertEqual((resp.data['sentence_count'], resp.data['word_count']), (2, 3))
+        article = Article.objects.get(uuid=resp.data['id'])
+        self.assertEqual(article.last_sentence_at, article.sentences.get(num=2).pub_date)
+        sentences_url = reverse('articles-sentences', kwargs={'pk':article.uuid})
+        detail_url = lambda num: reverse('articles-sentences/(?P<sentence-num>\\d+)',
+                                         kwargs={'pk':article.uuid, 'sentence_num':num})
+
+        self.client.post(sentences_url, ['four five six', 'seven'])
+        self.assertEqual(self.stats(article), (4, 7))
+        self.assertEqual(article.last_sentence_at, article.sentences.get(num=4).pub_date)
+        Sentence.objects.create(article=article, num=5, text='eight nine', author=self.user)
+        self.assertEqual(self.stats(article), (5, 9))
+        self.client.patch(detail_url(1), {'text':'one'})
+        self.assertEqual(self.stats(article), (5, 8))
+        self.client.patch(sentences_url, [{'num':2, 'text':'three and a half'}, {'num':3, 'text':'x'}])
+        self.assertEqual(self.stats(article), (5, 9))
+        self.client.post(reverse('articles-sentence-move', kwargs={'pk':article.uuid,
+                                                                   'sentence_num':5}), {'to':1})
+        self.assertEqual(self.stats(article), (5, 9))
+        self.check()
+
+        newest = article.sentences.get(num=1)  # moved, still the newest
+        self.client.delete(detail_url(1))
+        self.assertEqual(self.stats(article), (4, 7))
+        self.assertEqual(article.last_sentence_at, article.sentences.get(num=4).pub_date)
+        self.assertLess(article.last_sentence_at, newest.pub_date)
+        with self.settings(ARTICLES={'SENTENCE_GAPS': True}):
+            self.client.delete(detail_url(2))
+        self.assertEqual(self.stats(article), (3, 3))
+        self.check()
+        while article.sentences.exists():  # the first dense delete closes the gap
+            self.client.delete(detail_url(article.sentences.last().num))
+        self.assertEqual(self.stats(article), (0, 0))
+        self.assertIsNone(article.last_sentence_at)
+        self.check()
+
+    def test_rebuild_article_stats(self):
+        '''
+        Test manage.py rebuild_article_stats
+        Should report drifted articles with --check and fix them otherwise
+        '''
+        article = Article.objects.create(title='Test Article', author=self.user)
+        article.append_sentences(['one two', 'three'], author=self.user)
+        Article.objects.create(title='Empty', author=self.user)
+        self.check()
+        article.sentences.filter(num=2).update(text='three four')  # bypasses the statistics
+        with self.assertRaises(CommandError):
+            self.check()
+        out = io.StringIO()
+        call_command('rebuild_article_stats', stdout=out)
+        self.assertIn('2 articles checked, 1 drifted, rebuilt', out.getvalue())
+        self.assertEqual(self.stats(article), (2, 4))
+        self.check()
+
+    def test_bench_seed(self):
+        '''
+        Test the dataset seeded by manage.py bench
+        Should have the statistics of its sentences
+        '''
+        articles = bench.Command().seed(2, 2, 10)
+        self.check()
+        self.assertEqual({self.stats(article) for article in articles}, {(10, 60)})
+
+    def test_ordering_and_filtering(self):
+        '''
+        Test GET /articles/?ordering=<field>&<field>__gte=<value>
+        Should page through articles in statistics order, filtered, with a single plain query
+        '''
+        for i, count in enumerate((3, 0, 1, 3, 2, 0)):
+            article = Article.objects.create(title='Article %d' % i, author=self.user)
+            if count:
+                article.append_sentences(['word'] * count, author=self.user)
+        articles = list(Article.objects.all())
+        url = reverse('articles-list')
+
+        def follow(url):
+            items = []
+            while url:
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                items += resp.data
+                url = resp.get('Link', '').partition(';')[0].strip('<>') or None
+            return [item['id'] for item in items]
+
+        for ordering in ('sentence_count', '-word_count', 'last_sentence_at', '-last_sentence_at'):
+            field = ordering.lstrip('-')
+            key = lambda a: ((getattr(a, field) is not None, getattr(a, field)), a.id)
+            expected = sorted(articles, key=key, reverse=ordering.startswith('-'))
+            self.assertEqual(follow(url + '?page_size=2&ordering=' + ordering),
+                             [str(a.uuid) for a in expected], ordering)
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url, {'sentence_count__gte':2, 'ordering':'-sentence_count'})
+        self.assertEqual([a['sentence_count'] for a in resp.data], [3, 3, 2])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('JOIN', queries[0]['sql'])
+        resp = self.client.get(url, {'last_sentence_at__lt':'2000-01-01T00:00:00Z'})
+        self.assertEqual(resp.data, [])
+
+        for params in ({'ordering':'title'}, {'word_count__gt':'x'}, {'last_sentence_at':'y'}):
+            resp = self.client.get(url, params)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+SHARDS = ['test_shard_a', 'test_shard_b']
+
+
+def sharded(*aliases):
+    return override_settings(ARTICLES=dict(settings.ARTICLES, SHARDS=list(aliases)))
+
+
+@sharded(*SHARDS)
+class ShardingTest(APITransactionTestCase):
+    # two SQLite files as shards, next to the test database
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp(prefix='shards')
+        for alias in SHARDS:
+            connections.databases[alias] = sqlite.database(
+                os.path.join(cls.directory, alias + '.sqlite3'))
+            call_command('migrate', database=alias, run_syncdb=True, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections.databases[alias]
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def tearDown(self):
+        for alias in SHARDS:
+            Article.objects.using(alias).all().delete()
+
+    def users(self):
+        ''' One user on each shard. '''
+        users = {}
+        for i in range(100):
+            user = User.objects.create_user(username='user%d' % i)
+            users.setdefault(shards.for_author(user.pk), user)
+            if len(users) == len(SHARDS):
+                return [users[alias] for alias in SHARDS]
+
+    def test_mapping(self):
+        '''
+        Test shards.for_author with a shard appended
+        Should map authors stably, spread them and only move some to the new shard
+        '''
+        two = [shards.for_author(i, ['a', 'b']) for i in range(1, 3001)]
+        three = [shards.for_author(i, ['a', 'b', 'c']) for i in range(1, 3001)]
+        self.assertEqual(two, [shards.for_author(i, ['a', 'b']) for i in range(1, 3001)])
+        self.assertTrue(900 < two.count('a') < 2100)
+        moved = [(old, new) for old, new in zip(two, three) if old != new]
+        self.assertTrue(all(new == 'c' for old, new in moved))
+        self.assertTrue(750 < len(moved) < 1250)
+        self.assertIsNone(shards.for_author(1, []))
+
+    def test_requests_on_author_shard(self):
+        '''
+        Test the article and sentence routes of users on different shards
+        Should read and write each user's rows on their shard only
+        '''
+        users = self.users()
+        for user, alias in zip(users, SHARDS):
+            other = [a for a in SHARDS if a != alias][0]
+            self.client.force_authenticate(user)
+            resp = self.client.post(reverse('articles-list'),
+                                    {'title': alias, 'sentences': ['one', 'two', 'three']})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            pk = resp.data['id']
+            url = reverse('articles-sentences', kwargs={'pk': pk})
+            self.assertEqual(self.client.post(url, {'text': 'four'}).status_code, 201)
+            detail = reverse('articles-sentences/(?P<sentence-num>\\d+)',
+                             kwargs={'pk': pk, 'sentence_num': 1})
+            resp = self.client.patch(detail, {'text': 'first one'})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.post(reverse('articles-sentence-move',
+                                            kwargs={'pk': pk, 'sentence_num': 4}), {'to': 1})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.delete(detail.replace('/1/', '/2/')).status_code, 204)
+            resp = self.client.get(url)
+            self.assertEqual([s['text'] for s in resp.data], ['four', 'two', 'three'])
+            resp = self.client.get(reverse('articles-list'))
+            self.assertEqual([(a['title'], a['sentence_count'], a['word_count'])
+                              for a in resp.data], [(alias, 3, 3)])
+            resp = self.client.get(reverse('articles-search'), {'q': 'three'})
+            self.assertEqual([(str(r['article']), r['sentences']) for r in resp.data], [(pk, [3])])
+            self.assertEqual(Article.objects.using(alias).filter(author=user).count(), 1)
+            self.assertEqual(Sentence.objects.using(alias).filter(article__uuid=pk).count(), 3)
+            self.assertFalse(Article.objects.using(other).filter(author=user).exists())
+        self.assertFalse(Article.objects.using('default').exists())
+
+        users[0].delete()
+        self.assertFalse(Article.objects.using(SHARDS[0]).exists())
+        self.assertTrue(Article.objects.using(SHARDS[1]).exists())
+
+    def test_author_id(self):
+        '''
+        Test new articles and sentences given only the author's id
+        Should save them on the author's shard
+        '''
+        users = self.users()
+        for user, alias in zip(users, SHARDS):
+            article = Article.objects.create(title=alias, author_id=user.pk)
+            self.assertEqual(article._state.db, alias)
+            Article(title=alias, author_id=user.pk).save()
+            sentence = Sentence(article=Article(title=alias, author_id=user.pk), text='one',
+                                author_id=users[0].pk)
+            self.assertEqual(shards.for_instance(sentence), alias)
+            self.assertEqual(Article.objects.using(alias).filter(author=user.pk).count(), 2)
+
+    def test_invalidate_on_commit(self):
+        '''
+        Test writes in a transaction on a shard
+        Should drop the article's cached payloads again once the shard commits
+        '''
+        for user, alias in zip(self.users(), SHARDS):
+            article = Article.objects.create(title=alias, author=user)
+            with mock.patch('articles.cache.invalidate') as invalidate:
+                with transaction.atomic(using=alias):
+                    article.title = 'changed'
+                    article.save()
+                    article.append_sentences(['one'], author=user)
+                    self.assertEqual(invalidate.call_count, 2)
+                self.assertEqual(invalidate.call_count, 4)
+            invalidate.assert_called_with(article.uuid)
+
+    def test_rebalance(self):
+        '''
+        Test manage.py rebalance_shards from the default database, then onto an added shard
+        Should move articles with their sentences as they were to their author's shard
+        '''
+        users = [User.objects.create_user(username='user%d' % i) for i in range(20)]
+        with sharded():
+            for user in users:
+                article = Article.objects.create(title=user.username, author=user)
+                article.append_sentences(['one', 'two words'], author=user)
+            # primary keys are per database, public ids move with the rows
+            before = {a.uuid: (a.title, a.last_num, a.sentence_count, a.word_count, a.mod_date)
+                      for a in Article.objects.all()}
+            sentences = {s.uuid: (s.article.uuid, s.num, s.text, s.pub_date)
+                         for s in Sentence.objects.select_related('article')}
+
+        def check():
+            for user in users:
+                article = Article.objects.using(shards.for_author(user.pk)).get(author=user)
+                self.assertEqual((article.title, article.last_num, article.sentence_count,
+                                  article.word_count, article.mod_date), before[article.uuid])
+                self.assertEqual({s.uuid: (s.article.uuid, s.num, s.text, s.pub_date)
+                                  for s in article.sentences.all()},
+                                 {pk: v for pk, v in sentences.items() if v[0] == article.uuid})
+            self.assertEqual(sum(Sentence.objects.using(a).count() for a in SHARDS), len(sentences))
+
+        out = io.StringIO()
+        with sharded(SHARDS[0]):
+            call_command('rebalance_shards', dry_run=True, stdout=out)
+            self.assertIn('20 articles to move', out.getvalue())
+            self.assertEqual(Article.objects.using('default').count(), 20)
+            call_command('rebalance_shards', stdout=out)
+            self.assertFalse(Article.objects.using('default').exists())
+            check()
+        call_command('rebalance_shards', stdout=out)
+        self.assertTrue(all(Article.objects.using(a).exists() for a in SHARDS))
+        check()
+        out = io.StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertEqual(out.getvalue(), '0 articles moved\n')
+
+        self.client.force_authenticate(users[0])
+        resp = self.client.get(reverse('articles-list'))
+        self.assertEqual([a['title'] for a in resp.data], ['user0'])
+
+
+@override_settings(ARTICLES=dict(settings.ARTICLES, SYNC_OVERLAP=0))
+class SyncTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def sync(self, since=None, page_size=100):
+        ''' Follow the pages of a sync run, returns the changes by kind,
+            the final cursor and the number of pages. '''
+        changes, pages = {'articles': [], 'sentences': [], 'deleted': []}, 0
+        while True:
+            params = {'page_size': page_size}
+            if since is not None:
+                params['since'] = since
+            resp = self.client.get(reverse('sync'), params)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(sum(len(resp.data[kind]) for kind in changes), page_size)
+            for kind in changes:
+                changes[kind] += resp.data[kind]
+            since, pages = resp.data['cursor'], pages + 1
+            if not resp.data['more']:
+                return changes, since, pages
+
+    def article(self, title, texts, author=None):
+        article = Article.objects.create(title=title, author=author or self.user)
+        article.append_sentences(texts, author=author or self.user)
+        return article
+
+    def test_delta(self):
+        '''
+        Test GET /sync/ before and after changes
+        Should return everything first, then only the changes and deletions, renumbering included
+        '''
+        first = self.article('First', ['one', 'two', 'three'])
+        second = self.article('Second', ['four'])
+        other = User.objects.create_user(username='otheruser')
+        self.article('Foreign', ['five'], author=other)
+
+        changes, cursor, _ = self.sync()
+        self.assertEqual(sorted(a['title'] for a in changes['articles']), ['First', 'Second'])
+        self.assertEqual(sorted(s['text'] for s in changes['sentences']),
+                         ['four', 'one', 'three', 'two'])
+        self.assertEqual(changes['deleted'], [])
+        self.assertEqual(self.sync(cursor)[0], {'articles': [], 'sentences': [], 'deleted': []})
+
+        deleted = first.sentences.get(num=1)
+        url = reverse('articles-sentences/(?P<sentence-num>\\d+)',
+                      kwargs={'pk': first.uuid, 'sentence_num': 3})
+        self.client.put(url, {'text': 'three changed'})
+        self.client.delete(url.replace('/3/', '/1/'))
+        self.client.delete(reverse('articles-detail', kwargs={'pk': second.uuid}))
+        self.article('Foreign again', ['six'], author=other)
+
+        changes, cursor, _ = self.sync(cursor)
+        self.assertEqual([(a['id'], a['sentence_count']) for a in changes['articles']],
+                         [(str(first.uuid), 2)])
+        self.assertEqual(sorted((s['num'], s['text']) for s in changes['sentences']),
+                         [(1, 'two'), (2, 'three changed')])
+        self.assertEqual(sorted((d['type'], d['id'], d['article']) for d in changes['deleted']),
+                         [('article', str(second.uuid), str(second.uuid)),
+                          ('sentence', str(deleted.uuid), str(first.uuid))])
+        self.assertEqual(self.sync(cursor)[0], {'articles': [], 'sentences': [], 'deleted': []})
+
+    def test_pages(self):
+        '''
+        Test GET /sync/ over several pages, with a change in the middle of the run
+        Should return every change once, the one made during the run in the next run
+        '''
+        for i in range(5):
+            article = self.article('Article %d' % i, ['sentence'] * 3)
+            article.delete_sentence(article.sentences.get(num=3))
+        changes, cursor, pages = self.sync(page_size=4)
+        self.assertEqual((len(changes['articles']), len(changes['sentences']),
+                          len(changes['deleted'])), (5, 10, 5))
+        self.assertEqual(pages, 5)
+        for kind in changes:
+            self.assertEqual(len({c['id'] for c in changes[kind]}), len(changes[kind]))
+
+        resp = self.client.get(reverse('sync'), {'page_size': 4})
+        article.append_sentences(['late'], author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('sync'), {'since': resp.data['cursor']})
+        self.assertEqual([s['text'] for s in resp.data['sentences'] if s['text'] == 'late'], [])
+        self.assertEqual(len(queries), 3)  # one per stream
+        changes = self.sync(resp.data['cursor'])[0]
+        self.assertEqual([s['text'] for s in changes['sentences']], ['late'])
+        self.assertEqual([a['id'] for a in changes['articles']], [str(article.uuid)])
+
+    def test_cursor(self):
+        '''
+        Test GET /sync/ with malformed and expired cursors
+        Should return 404 Not Found and 410 Gone
+        '''
+        for since in ('x', sync.Cursor(None, None, 0, None).encode(),
+                      sync.Cursor(timezone.now(), None, 5, None).encode()):
+            resp = self.client.get(reverse('sync'), {'since': since})
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        expired = timezone.now() - timedelta(days=31)
+        since = sync.Cursor(expired, None, 0, None).encode()
+        resp = self.client.get(reverse('sync'), {'since': since})
+        self.assertEqual(resp.status_code, status.HTTP_410_GONE)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('sync')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(ARTICLES=dict(settings.ARTICLES, EVENT_HEARTBEAT=0.05))
+class EventStreamTest(APITransactionTestCase):
+    # events are published on commit
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+        self.article = Article.objects.create(title='Watched', author=self.user)
+        self.article.append_sentences(['one', 'two', 'three'], author=self.user)
+
+    def tearDown(self):
+        events.close(self.article.uuid)
+
+    def stream(self, last_event_id=None):
+        headers = {} if last_event_id is None else {'HTTP_LAST_EVENT_ID': last_event_id}
+        resp = self.client.get(reverse('articles-events', kwargs={'pk':self.article.uuid}),
+                               HTTP_ACCEPT='text/event-stream', **headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream; charset=utf-8')
+        self.assertEqual(resp['Cache-Control'], 'no-cache')
+        chunks = iter(resp.streaming_content)
+        self.assertEqual(next(chunks), b'retry: 3000\n\n')
+        return chunks
+
+    def read(self, chunks):
+        ' Events until the next heartbeat, as (id, name, data). '
+        result = []
+        for chunk in chunks:
+            if chunk == b': heartbeat\n\n':
+                return result
+            fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').split('\n') if line)
+            result.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+        return result
+
+    def test_events(self):
+        '''
+        Test GET /articles/<pk>/events/ while sentences are written
+        Should stream creations, updates, deletions, renumbering and the article deletion
+        '''
+        chunks = self.stream()
+        self.assertEqual(self.read(chunks), [])  # a heartbeat
+
+        url = reverse('articles-sentences', kwargs={'pk':self.article.uuid})
+        self.client.post(url, {'text': 'four'}, format='json')
+        detail = lambda num: reverse('articles-sentences/(?P<sentence-num>\\d+)',
+                                     kwargs={'pk':self.article.uuid, 'sentence_num':num})
+        self.client.patch(detail(2), {'text': 'deux'}, format='json')
+        self.client.patch(url, [{'num': 1, 'text': 'un'}], format='json')
+        self.client.delete(detail(3))
+        self.client.post(reverse('articles-sentence-move',
+                                 kwargs={'pk':self.article.uuid, 'sentence_num':3}),
+                         {'to': 1}, format='json')
+        self.client.post(reverse('articles-sentence-reorder', kwargs={'pk':self.article.uuid}),
+                         {'order': [2, 1, 3]}, format='json')
+        received = self.read(chunks)
+        self.assertEqual([name for _, name, _ in received],
+                         ['created', 'updated', 'updated', 'deleted', 'renumbered',
+                          'renumbered', 'renumbered'])
+        self.assertEqual([data.get('text') for _, _, data in received[:3]], ['four', 'deux', 'un'])
+        self.assertEqual(received[3][2]['num'], 3)
+        self.assertEqual([data for _, _, data in received[4:]],
+                         [{'op': 'shift', 'from': 4, 'by': -1},
+                          {'op': 'move', 'from': 3, 'to': 1},
+                          {'op': 'reorder', 'order': [2, 1, 3]}])
+        self.assertEqual(len({id for id, _, _ in received}), len(received))
+
+        self.client.delete(reverse('articles-detail', kwargs={'pk':self.article.uuid}))
+        self.assertEqual([name for _, name, _ in self.read(chunks)], ['article_deleted'])
+        self.assertEqual(list(chunks), [])  # the stream ended
+
+    def test_resume(self):
+        '''
+        Test GET /articles/<pk>/events/ with a Last-Event-ID header
+        Should send the events after it, or a reset when some may be missing
+        '''
+        chunks = self.stream()
+        for text in ('four', 'five', 'six'):
+            self.article.append_sentences([text], author=self.user)
+        received = self.read(chunks)
+        self.assertEqual([data['text'] for _, _, data in received], ['four', 'five', 'six'])
+
+        resumed = self.read(self.stream(received[0][0]))
+        self.assertEqual(resumed, received[1:])
+        self.assertEqual(self.read(self.stream(received[-1][0])), [])
+        for last_event_id in ('x', 'other-1', events.BOOT + '-99999', events.BOOT + '-0'):
+            self.assertEqual(self.read(self.stream(last_event_id)), [(None, 'reset', {})])
+
+        with override_settings(ARTICLES=dict(settings.ARTICLES, EVENT_HEARTBEAT=0.05,
+                                             EVENT_BUFFER=2)):
+            events.close(self.article.uuid)
+            chunks = self.stream()
+            received = []
+            for text in ('seven', 'eight', 'nine', 'ten'):
+                self.article.append_sentences([text], author=self.user)
+                received += self.read(chunks)  # kept up with
+            self.assertEqual(len(received), 4)
+            self.assertEqual(self.read(self.stream(received[1][0])), received[2:])
+            self.assertEqual(self.read(self.stream(received[0][0])), [(None, 'reset', {})])
+            for text in ('eleven', 'twelve', 'thirteen'):
+                self.article.append_sentences([text], author=self.user)
+            self.assertEqual(self.read(chunks), [(None, 'reset', {})])  # fell behind
+
+    def test_access(self):
+        '''
+        Test GET /articles/<pk>/events/ of another user's article
+        Should return 404 Not Found and not watch the article
+        '''
+        other = User.objects.create_user(username='otheruser')
+        self.client.force_authenticate(other)
+        resp = self.client.get(reverse('articles-events', kwargs={'pk':self.article.uuid}),
+                               HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(events.watched(self.article.uuid))
+
+
+class ConvertPrimaryKeysTest(TransactionTestCase):
+    # a database in the UUID primary key layout, next to the test database
+    alias = 'test_uuid_pks'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='uuid_pks')
+        connections.databases[self.alias] = sqlite.database(
+            os.path.join(self.directory, 'db.sqlite3'), 'default')
+
+    def tearDown(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+        del connections.databases[self.alias]
+        search._indexes.pop(self.alias, None)
+        shutil.rmtree(self.directory)
+
+    def fts_schema(self):
+        ''' The search index over tables with UUID primary keys. '''
+        return [s.replace('{fts}', search.FTSIndex.table)
+                .replace("'id'", "'rowid'").replace('.id', '.rowid')
+                for s in search.FTSIndex.statements]
+
+    def test_convert(self):
+        '''
+        Test manage.py convert_int_pks on tables with UUID primary keys
+        Should keep every row under its UUID as public id, with integer keys and search reindexed
+        '''
+        user = User.objects.create_user(username='testuser')
+        articles = [uuid.uuid4() for _ in range(3)]
+        sentences = [(uuid.uuid4(), article, num, 'sentence %d of %s' % (num, title))
+                     for article, title in zip(articles, ('one', 'two', 'three'))
+                     for num in (2, 1)]
+        with connections[self.alias].cursor() as cursor:
+            for statement in UUID_SCHEMA + self.fts_schema():
+                cursor.execute(statement)
+            for i, article in enumerate(reversed(articles)):
+                cursor.execute('INSERT INTO articles_article VALUES (%s, %s, %s, %s, %s, 2, 2, 8, '
+                               'NULL)', [article.hex, 'Article %d' % i,
+                                         '2018-01-0%d 00:00:00' % (3 - i),
+                                         '2018-01-0%d 00:00:00' % (3 - i), user.pk])
+            cursor.executemany('INSERT INTO articles_sentence VALUES (%s, %s, %s, %s, '
+                               "'2018-01-04 00:00:00', '2018-01-04 00:00:00', %s)",
+                               [(pk.hex, article.hex, num, text, user.pk)
+                                for pk, article, num, text in sentences])
+
+        out = io.StringIO()
+        call_command('convert_int_pks', database=[self.alias], stdout=out)
+        self.assertEqual(out.getvalue(), '%s: 3 articles, 6 sentences converted\n' % self.alias)
+        rows = Article.objects.using(self.alias).order_by('pk')
+        self.assertEqual([(a.pk, a.uuid, a.sentence_count) for a in rows],
+                         [(i + 1, article, 2) for i, article in enumerate(articles)])
+        rows = Sentence.objects.using(self.alias).select_related('article').order_by('pk')
+        self.assertEqual([(s.pk, s.uuid, s.article.uuid, s.num, s.text) for s in rows],
+                         [(i + 1,) + s for i, s in enumerate(sorted(
+                             sentences, key=lambda s: (articles.index(s[1]), s[2])))])
+        results = search.get_index(self.alias).search(user.pk, 'of two', 10)
+        self.assertEqual([(r['article'], r['sentences']) for r in results], [(articles[1], [1, 2])])
+        article = Article.objects.using(self.alias).get(uuid=articles[0])
+        sentence = Sentence.objects.using(self.alias).create(article=article, num=3, text='new',
+                                                             author=user)
+        self.assertEqual(sentence.pk, 7)
+
+        out = io.StringIO()
+        call_command('convert_int_pks', database=[self.alias], stdout=out)
+        self.assertEqual(out.getvalue(), '%s: already converted\n' % self.alias)
+
+    def test_convert_baseline(self):
+        '''
+        Test manage.py convert_int_pks on the first layout, without statistics or deletion log
+        Should compute the statistics and sentence counter and create the deletion log
+        '''
+        user = User.objects.create_user(username='testuser')
+        article = uuid.uuid4()
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE "auth_user" ("id" integer NOT NULL PRIMARY KEY)')
+            cursor.execute('INSERT INTO auth_user VALUES (%s)', [user.pk])
+            for statement in BASELINE_SCHEMA:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO articles_article VALUES (%s, 'Article', "
+                           "'2018-01-01 00:00:00', '2018-01-01 00:00:00', %s)",
+                           [article.hex, user.pk])
+            cursor.executemany("INSERT INTO articles_sentence VALUES (%s, %s, %s, %s, %s, "
+                               "'2018-01-03 00:00:00', %s)",
+                               [(uuid.uuid4().hex, article.hex, 1, 'one two', '2018-01-02 00:00:00',
+                                 user.pk),
+                                (uuid.uuid4().hex, article.hex, 3, 'three', '2018-01-03 00:00:00',
+                                 user.pk)])
+
+        out = io.StringIO()
+        call_command('convert_int_pks', database=[self.alias], stdout=out)
+        self.assertEqual(out.getvalue(), '%s: 1 articles, 2 sentences converted\n' % self.alias)
+        row = Article.objects.using(self.alias).get(uuid=article)
+        self.assertEqual((row.last_num, row.sentence_count, row.word_count), (3, 2, 3))
+        self.assertEqual(row.last_sentence_at.day, 3)
+        Tombstone.objects.using(self.alias).create(author_id=user.pk, article=article)
+        results = search.get_index(self.alias).search(user.pk, 'two', 10)
+        self.assertEqual([(r['article'], r['sentences']) for r in results], [(article, [1])])
+
+    def test_convert_failure(self):
+        '''
+        Test manage.py convert_int_pks failing halfway
+        Should leave the tables and the search index as they were
+        '''
+        with connections[self.alias].cursor() as cursor:
+            for statement in UUID_SCHEMA + self.fts_schema():
+                cursor.execute(statement)
+        with mock.patch('articles.search.install', side_effect=DatabaseError('failed')):
+            with self.assertRaises(DatabaseError):
+                call_command('convert_int_pks', database=[self.alias], stdout=io.StringIO())
+        connection = connections[self.alias]
+        with connection.cursor() as cursor:
+            columns = [column.name for column in
+                       connection.introspection.get_table_description(cursor, 'articles_article')]
+        self.assertNotIn('uuid', columns)
+        self.assertTrue(search.FTSIndex(self.alias).installed())
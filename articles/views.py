@@ -1,82 +1,403 @@
-from django.shortcuts import get_object_or_404
+from collections import OrderedDict
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, router, transaction
+from django.db.models import Count, Max, Prefetch
+from django.http import Http404, StreamingHttpResponse
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
+from config import routers
+from config.middleware import timer
+from articles import cache, events, search, shards, sync
+from articles.conditional import conditional, validators
 from articles.models import *
+from articles.filters import StatisticsFilter
+from articles.pagination import ArticlePagination, SentencePagination
+from articles.parsers import PlainTextParser
+from articles.renderers import EventStreamRenderer, NDJSONRenderer, PlainTextRenderer
 from articles.serializers import *
 
-class ArticleViewSet(ModelViewSet):
+
+def sentence_texts(data):
+    ''' Extract sentence texts from request data.
+        Accepts {'text': ...}, a list of strings or {'text': ...} objects,
+        or a newline-delimited plain text body.
+        Returns (texts, many). '''
+    if isinstance(data, (str, list)):
+        if isinstance(data, str):
+            data = [line for line in data.splitlines() if line.strip()]
+        texts = []
+        for item in data:
+            if isinstance(item, dict):
+                item = item.get('text')
+            if not isinstance(item, str) or not item:
+                raise ValidationError({'text': 'Each sentence must be a non-empty string.'})
+            texts.append(item)
+        if not texts:
+            raise ValidationError({'text': 'At least one sentence is required.'})
+        return texts, True
+    text = data.get('text') if hasattr(data, 'get') else None
+    if not text:
+        raise ValidationError({'text': 'This field is required.'})
+    if not isinstance(text, str):
+        raise ValidationError({'text': 'Not a valid string.'})
+    return [text], False
+
+
+def article_validators(view, request, pk=None, **kwargs):
+    ''' Validators of an article and its sentences, from one aggregate query. '''
+    try:
+        row = (Article.objects.for_author(request.user.id).filter(uuid=pk)
+               .annotate(changed=Max('sentences__mod_date'), total=Count('sentences'))
+               .values_list('mod_date', 'changed', 'total').first())
+    except DjangoValidationError:  # malformed pk
+        return None
+    if row is None:
+        return None
+    mod_date, changed, total = row
+    return validators(pk, mod_date, changed or mod_date, total, request=request)
+
+
+def sentences_validators(view, request, pk=None, **kwargs):
+    ''' Validators of the sentence list of an article, the article's: deletes
+        leave no row behind, but bump the article's mod_date. '''
+    return article_validators(view, request, pk=pk)
+
+
+def sentence_validators(view, request, pk=None, sentence_num=None, **kwargs):
+    ''' Validators of a single sentence. '''
+    try:
+        row = (Sentence.objects.for_author(request.user.id)
+               .filter(article__uuid=pk, num=sentence_num)
+               .values_list('uuid', 'mod_date').first())
+    except DjangoValidationError:
+        return None
+    if row is None:
+        return None
+    return validators(pk, sentence_num, *row, request=request)
+
+
+class PrimaryPinMixin(object):
+    ''' Times authentication for the instrumentation, then routes reads of
+        clients pinned after a write to the primary, so they read their own
+        recent writes. '''
+
+    def perform_authentication(self, request):
+        with timer('auth'):
+            super().perform_authentication(request)
+        if routers.is_pinned(request.user):
+            routers.use_primary()
+
+
+class ArticleViewSet(PrimaryPinMixin, ModelViewSet):
+    ''' Articles are looked up by their public id, `<pk>` in the URLs. '''
     serializer_class = ArticleSerializer
+    lookup_field = 'uuid'
+    lookup_url_kwarg = 'pk'
     permission_classes = (IsAuthenticated,)
+    pagination_class = ArticlePagination
+    filter_backends = (StatisticsFilter,)
 
     def get_queryset(self):
-        return Article.objects.filter(author=self.request.user.id)
+        queryset = Article.objects.for_author(self.request.user.id)
+        if self.action == 'destroy':
+            return queryset  # nothing is serialized
+        fields = self.requested_fields()
+        if 'sentences' in self.expanded_fields() and (not fields or 'sentences' in fields):
+            sentences = Sentence.objects.only('article', 'num', 'text')
+            queryset = queryset.prefetch_related(Prefetch('sentences', queryset=sentences))
+        return queryset
+
+    def requested_fields(self):
+        ''' Fields selected with ?fields=a,b (empty for all). '''
+        return set(filter(None, self.request.query_params.get('fields', '').split(',')))
+
+    def expanded_fields(self):
+        ''' Fields expanded with ?expand=a,b. Details expand sentences by default. '''
+        expand = self.request.query_params.get('expand')
+        if expand is None:
+            return set() if self.action == 'list' else {'sentences'}
+        return set(filter(None, expand.split(',')))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update(fields=self.requested_fields(), expand=self.expanded_fields())
+        return context
+
+    def owns_article(self, pk):
+        ''' Whether article `pk` exists and belongs to the requesting user. '''
+        try:
+            return Article.objects.for_author(self.request.user.id).filter(uuid=pk).exists()
+        except DjangoValidationError:  # malformed pk
+            return False
+
+    def shard(self):
+        ''' Database holding the requesting user's articles. '''
+        return shards.for_author(self.request.user.id) or router.db_for_write(Article)
+
+    def cached_response(self, article_id, kind, build, allowed=None):
+        ''' Response from the payload cache, built with build() on a miss.
+            `allowed()` is checked before serving a hit when build() is
+            what would have checked access. '''
+        if cache.get_cache() is None:
+            return build()
+        key, cached = cache.lookup(article_id, kind, self.request)
+        if cached is not None:
+            if allowed is not None and not allowed():
+                return Response(status=404)
+            data, headers = cached
+            response = Response(data, headers=headers)
+            response['X-Cache'] = 'hit'
+            return response
+        response = build()
+        if response.status_code == 200:
+            headers = {'Link': response['Link']} if response.has_header('Link') else {}
+            cache.store(key, (response.data, headers))
+        response['X-Cache'] = 'miss'
+        return response
+
+    @conditional(article_validators)
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(kwargs['pk'], 'article',
+                                    lambda: super(ArticleViewSet, self).retrieve(request, *args, **kwargs),
+                                    allowed=lambda: self.owns_article(kwargs['pk']))
+
+    def nested_sentences(self):
+        ''' Texts of the optional `sentences` array of a new article. '''
+        data = self.request.data
+        sentences = data.get('sentences') if hasattr(data, 'get') else None
+        if sentences is None or sentences == []:
+            return []
+        if not isinstance(sentences, list):
+            raise ValidationError({'sentences': 'Expected a list of sentences.'})
+        try:
+            return sentence_texts(sentences)[0]
+        except ValidationError as e:
+            raise ValidationError({'sentences': e.detail['text']})
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        ''' Create the article and its nested sentences, numbered from 1,
+            in one transaction with a batched insert. '''
+        texts = self.nested_sentences()
+        if texts:
+            with transaction.atomic(using=self.shard()):
+                article = serializer.save(author=self.request.user)
+                sentences = article.append_sentences(texts, author=self.request.user)
+        else:
+            article, sentences = serializer.save(author=self.request.user), []
+        # spare the serializer reading back what was just written
+        article._prefetched_objects_cache = {'sentences': sentences}
 
-    @detail_route(methods=['get', 'post'])
+    @list_route(methods=['get'])
+    def search(self, request, *args, **kwargs):
+        ''' Rank the user's articles containing the phrase ?q=,
+            with the numbers of the matching sentences.'''
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This parameter is required.'})
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        return Response(search.get_index(self.shard()).search(request.user.id, query, limit))
+
+    @detail_route(methods=['get', 'post', 'patch'],
+                  parser_classes=api_settings.DEFAULT_PARSER_CLASSES + [PlainTextParser])
+    @conditional(sentences_validators)
     def sentences(self, request, *args, **kwargs):
         ''' Retrieve list of sentences in an article for GET,
-            add a new sentence to an article for POST.'''
+            add new sentences to an article for POST,
+            update many sentences, [{"num": ..., "text": ...}, ...], for PATCH.'''
         article_id = self.kwargs['pk']
-        article = get_object_or_404(Article.objects.all(), pk=article_id)
-        queryset = Sentence.objects.filter(article=article)
-
-        if request.user != article.author:
-            return Response(status=404)
 
-        # GET all sentences
+        # GET a page of sentences
         if request.method == 'GET':
-            serializer = SentenceSerializer(queryset, many=True)
-            return Response(serializer.data)
+            # the article is only looked up when the page comes back empty
+            queryset = (Sentence.objects.for_author(request.user.id)
+                        .filter(article__uuid=article_id).select_related('article'))
+            def build():
+                paginator = SentencePagination()
+                try:
+                    page = paginator.paginate_queryset(queryset, request, view=self)
+                except DjangoValidationError:  # malformed pk
+                    raise Http404
+                if not page and not self.owns_article(article_id):
+                    raise Http404
+                serializer = SentenceSerializer(page, many=True)
+                return paginator.get_paginated_response(serializer.data)
+            return self.cached_response(article_id, 'sentences', build,
+                                        allowed=lambda: self.owns_article(article_id))
         
-        # POST a sentence
+        # POST one or more sentences
         elif request.method == 'POST':
-            text = self.request.data['text']  # sentence text
-            author = self.request.user  # sentence author
-            num = 1  # default sentence number
-            if queryset:
-                num = queryset.last().num + 1  # override number
-            new_sentence = Sentence.objects.create(text=self.request.data['text'],
-                                                    article=article,
-                                                    num=num,
-                                                    author=self.request.user)
-            new_sentence.save()
-            serializer = SentenceSerializer(new_sentence)
+            article = get_object_or_404(Article.objects.for_author(request.user.id),
+                                        uuid=article_id)
+            texts, many = sentence_texts(request.data)
+            new_sentences = article.append_sentences(texts, author=request.user)
+            if many:
+                serializer = SentenceSerializer(new_sentences, many=True)
+            else:
+                serializer = SentenceSerializer(new_sentences[0])
             return Response(serializer.data, status=201)
 
-    @detail_route(methods=['get', 'put', 'delete'], url_path='sentences/(?P<sentence_num>\d+)')
+        # PATCH many sentences
+        elif request.method == 'PATCH':
+            with transaction.atomic(using=self.shard()):
+                article = get_object_or_404(Article.objects.for_author(request.user.id),
+                                            uuid=article_id)
+                sentences = self.batch_update(article, request.data)
+            return Response(SentenceSerializer(sentences, many=True).data)
+
+    def batch_update(self, article, data):
+        ''' Validate [{"num": ..., <fields>}, ...] against the sentences of
+            `article` and write the changed ones, returns the sentences. '''
+        if not isinstance(data, list) or not data:
+            raise ValidationError({'non_field_errors': ['Expected a non-empty list of sentences.']})
+        nums = [item.get('num') if isinstance(item, dict) else None for item in data]
+        found = {s.num: s for s in article.sentences.filter(
+            num__in=[num for num in nums if type(num) is int])}
+        sentences, changed, errors, seen = [], [], [], set()
+        for num, item in zip(nums, data):
+            sentence = found.get(num)
+            if sentence is None or num in seen:
+                errors.append({'num': ['Expected the number of a sentence of the article, once.']})
+                continue
+            seen.add(num)
+            serializer = SentenceSerializer(sentence, data=item, partial=True)
+            if not serializer.is_valid():
+                errors.append(serializer.errors)
+                continue
+            errors.append({})
+            sentences.append(sentence)
+            if any(getattr(sentence, name) != value
+                   for name, value in serializer.validated_data.items()):
+                for name, value in serializer.validated_data.items():
+                    setattr(sentence, name, value)
+                changed.append(sentence)
+        if any(errors):
+            raise ValidationError(errors)
+        if changed:
+            article.update_sentences(changed)
+        return sentences
+
+    @detail_route(methods=['get'], renderer_classes=[NDJSONRenderer, PlainTextRenderer])
+    def export(self, request, *args, **kwargs):
+        ''' Stream all sentences of an article in num order,
+            as NDJSON (?format=ndjson, default) or plain text (?format=text).'''
+        if not self.owns_article(kwargs['pk']):
+            return Response(status=404)
+        rows = (Sentence.objects.for_author(request.user.id).filter(article__uuid=kwargs['pk'])
+                .order_by('num')
+                .values_list('num', 'text').iterator(chunk_size=2000))
+        renderer = request.accepted_renderer
+        content_type = '%s; charset=%s' % (renderer.media_type, renderer.charset)
+        return StreamingHttpResponse(renderer.stream(rows), content_type=content_type)
+
+    @detail_route(methods=['get'], renderer_classes=[EventStreamRenderer])
+    def events(self, request, *args, **kwargs):
+        ''' Server-Sent Events of the article's sentences as they are
+            written: created, updated and deleted sentences, renumbered
+            ranges and the deletion of the article. Resumes after the
+            Last-Event-ID header, or asks to reload with a reset event. '''
+        if not self.owns_article(kwargs['pk']):
+            return Response(status=404)
+        subscription = events.subscribe(Article._meta.get_field('uuid').to_python(kwargs['pk']),
+                                        request.META.get('HTTP_LAST_EVENT_ID'))
+        for conn in connections.all():
+            if not conn.in_atomic_block:
+                conn.close()  # idle streams hold no database connection
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(subscription),
+            content_type='%s; charset=%s' % (renderer.media_type, renderer.charset))
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # proxies pass events on as they come
+        return response
+
+    def get_sentence(self):
+        ''' The sentence of the URL, with its article. One query joined
+            against the article: a missing article, a foreign one and a
+            missing sentence all end up as the same 404. '''
+        queryset = Sentence.objects.for_author(self.request.user.id).select_related('article')
+        return get_object_or_404(queryset, article__uuid=self.kwargs['pk'],
+                                 num=self.kwargs['sentence_num'])
+
+    @detail_route(methods=['get', 'put', 'patch', 'delete'],
+                  url_path='sentences/(?P<sentence_num>\d+)')
+    @conditional(sentence_validators)
     def sentence_detail(self, request, *args, **kwargs):
         '''Retrieve, update or delete a sentence in an article'''
-        article_id = self.kwargs['pk']
-        article = get_object_or_404(Article.objects.all(), pk=article_id)
-        sentence_num = self.kwargs['sentence_num']
-        queryset = Sentence.objects.filter(article=article_id)
-        sentence = get_object_or_404(queryset, num=sentence_num)
-        serializer =  SentenceSerializer(sentence)
+        sentence = self.get_sentence()
 
-        if request.user != article.author:
-            return Response(status=404)
-       
         # GET sentence 
         if request.method == 'GET':
-            return Response(serializer.data)
+            return Response(SentenceSerializer(sentence).data)
         
-        # PUT (update) sentence
-        elif request.method == 'PUT':
-            for attr, value in self.request.data.items():            
-                if value:  # if attribute is not in data, value shouldn't be updated
-                    setattr(sentence, attr, value)
-            sentence.save()
+        # PUT / PATCH (update) sentence
+        elif request.method in ('PUT', 'PATCH'):
+            serializer = SentenceSerializer(sentence, data=request.data,
+                                            partial=request.method == 'PATCH')
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
             return Response(serializer.data)
 
         # DELETE a sentence
         elif request.method == 'DELETE':
-            sentence.delete()
-            # cascade nums
-            for s in Sentence.objects.filter(article=article_id, num__gt=sentence.num):
-                s.num = s.num-1
-                s.save()
+            sentence.article.delete_sentence(sentence)
             return Response(status=204)
+
+    @detail_route(methods=['post'], url_path='sentences/(?P<sentence_num>\d+)/move',
+                  url_name='sentence-move')
+    def sentence_move(self, request, *args, **kwargs):
+        ''' Move a sentence to number {"to": ...}, shifting the ones in between. '''
+        sentence = self.get_sentence()
+        try:
+            to = int(request.data.get('to'))
+        except (AttributeError, TypeError, ValueError):
+            raise ValidationError({'to': 'A valid integer is required.'})
+        try:
+            sentence = sentence.article.move_sentence(sentence, to)
+        except ValueError as e:
+            raise ValidationError({'to': str(e)})
+        return Response(SentenceSerializer(sentence).data)
+
+    @detail_route(methods=['post'], url_path='sentences/reorder', url_name='sentence-reorder')
+    def sentence_reorder(self, request, *args, **kwargs):
+        ''' Renumber all sentences from {"order": [...]}, a permutation of
+            their current numbers in the new order. '''
+        article = get_object_or_404(Article.objects.for_author(request.user.id),
+                                    uuid=self.kwargs['pk'])
+        order = request.data.get('order') if hasattr(request.data, 'get') else None
+        if not isinstance(order, list) or not all(type(num) is int for num in order):
+            raise ValidationError({'order': 'Expected a list of sentence numbers.'})
+        try:
+            article.reorder_sentences(order)
+        except ValueError as e:
+            raise ValidationError({'order': str(e)})
+        return Response(status=204)
+
+
+class SyncView(PrimaryPinMixin, APIView):
+    ''' Changes to the user's articles and sentences since ?since=, the
+        cursor returned by the previous sync (everything without one).
+        Each page holds up to ?page_size= changes and a cursor: pass it
+        back while "more" is true, keep the last one for the next sync. '''
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        cursor = sync.start(request.query_params.get('since'))
+        page_size = SentencePagination().get_page_size(request)
+        rows, cursor, more = sync.changes(request.user.id, cursor, page_size)
+        articles = ArticleSerializer(rows['articles'], many=True, context={'expand': ()})
+        return Response(OrderedDict([
+            ('articles', articles.data),
+            ('sentences', SentenceSerializer(rows['sentences'], many=True).data),
+            ('deleted', TombstoneSerializer(rows['deleted'], many=True).data),
+            ('cursor', cursor.encode()),
+            ('more', more),
+        ]))
@@ -0,0 +1,115 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+
+DEFAULTS = {
+    'TTL': 30,  # seconds a decoded token is trusted without a user lookup
+    'MAX_ENTRIES': 10000,
+}
+
+
+def options():
+    return dict(DEFAULTS, **getattr(settings, 'JWT_AUTH_CACHE', {}))
+
+
+class TokenCache(object):
+    ''' Thread-safe LRU of token -> user, bounded in size and entry age,
+        by JWT_AUTH_CACHE unless given. Users are copied in and out, so
+        that concurrent requests never share an instance. '''
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # token -> (user, expires at)
+        self.tokens = defaultdict(set)  # user id -> tokens
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires <= time.time():
+                self._remove(token)
+                return None
+            self.entries.move_to_end(token)
+        return copy.deepcopy(user)
+
+    def set(self, token, user, expires=None):
+        opts = options()
+        ttl = opts['TTL'] if self.ttl is None else self.ttl
+        max_entries = opts['MAX_ENTRIES'] if self.max_entries is None else self.max_entries
+        expires = min(expires or float('inf'), time.time() + ttl)
+        user = copy.deepcopy(user)
+        with self.lock:
+            self.entries[token] = (user, expires)
+            self.entries.move_to_end(token)
+            self.tokens[user.pk].add(token)
+            while len(self.entries) > max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def evict_user(self, user_id):
+        with self.lock:
+            for token in list(self.tokens.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tokens.clear()
+
+    def _remove(self, token):
+        user, _ = self.entries.pop(token)
+        tokens = self.tokens[user.pk]
+        tokens.discard(token)
+        if not tokens:
+            del self.tokens[user.pk]
+
+
+token_cache = TokenCache()
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    '''
+    JSONWebTokenAuthentication that keeps decoded tokens and their users in
+    a per-process LRU cache, skipping signature checks and the user query
+    for repeated tokens. Entries of a user are evicted as soon as the user
+    is saved (e.g. deactivated) or deleted in this process, and again when
+    that commits; other processes notice within JWT_AUTH_CACHE['TTL'] seconds.
+    '''
+
+    def authenticate(self, request):
+        jwt_value = self.get_jwt_value(request)
+        if jwt_value is None:
+            return None
+        user = token_cache.get(jwt_value)
+        if user is not None:
+            return (user, jwt_value)
+
+        self.payload = None
+        user, jwt_value = super().authenticate(request)
+        token_cache.set(jwt_value, user, expires=self.payload.get('exp'))
+        return (user, jwt_value)
+
+    def authenticate_credentials(self, payload):
+        self.payload = payload
+        return super().authenticate_credentials(payload)
+
+
+def evict_user(sender, instance, using=None, **kwargs):
+    ''' Evict now and again once the transaction commits, so that a
+        concurrent request cannot cache the user as it was before. '''
+    user_id = instance.pk  # cleared by delete() before the commit
+    token_cache.evict_user(user_id)
+    transaction.on_commit(lambda: token_cache.evict_user(user_id), using=using)
+
+
+post_save.connect(evict_user, sender=get_user_model(), dispatch_uid='jwt_token_cache_save')
+post_delete.connect(evict_user, sender=get_user_model(), dispatch_uid='jwt_token_cache_delete')
@@ -0,0 +1,177 @@
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+from config import routers
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PROFILE_SAMPLE_RATE': 0.0,  # fraction of requests run under cProfile
+    'PROFILE_DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+}
+
+_local = threading.local()
+
+
+class Timings(object):
+    ''' Durations (seconds) and counts of the phases of one request. '''
+
+    def __init__(self):
+        self.durations = OrderedDict()
+        self.counts = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def header(self):
+        ''' Server-Timing header value. '''
+        metrics = []
+        for name, duration in self.durations.items():
+            metric = '%s;dur=%.3f' % (name, duration * 1000)
+            if name == 'db':
+                metric += ';desc="%d queries"' % self.counts[name]
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timer(name):
+    ''' Add the time spent in the block to the current request's timings.
+        Does nothing outside an instrumented request. '''
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+class InstrumentationMiddleware(object):
+    '''
+    Records per-request query count and database time, authentication,
+    serializer, view and render time and sends them in a Server-Timing
+    header. A sample of requests is profiled with cProfile and dumped to
+    INSTRUMENTATION['PROFILE_DIR']. Removed from the middleware chain unless
+    INSTRUMENTATION['ENABLED'] is set.
+    '''
+
+    def __init__(self, get_response):
+        self.options = dict(DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {}))
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = _local.timings = Timings()
+        profiler = None
+        if random.random() < self.options['PROFILE_SAMPLE_RATE']:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.record_query))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            del _local.timings
+        timings.add('total', time.perf_counter() - start)
+        response['Server-Timing'] = timings.header()
+        if profiler is not None:
+            self.dump(profiler, request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentation_view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        ''' Called between the view and rendering. '''
+        view_end = time.perf_counter()
+        timings = _local.timings
+        timings.add('view', view_end - getattr(request, '_instrumentation_view_start', view_end))
+        response.add_post_render_callback(
+            lambda response: timings.add('render', time.perf_counter() - view_end))
+        return response
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            timings = getattr(_local, 'timings', None)
+            if timings is not None:
+                timings.add('db', time.perf_counter() - start)
+
+    def dump(self, profiler, request):
+        directory = self.options['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = re.sub(r'[^\w.-]+', '_', request.path).strip('_') or 'root'
+        name = '%d-%s-%s.prof' % (time.time() * 1000, request.method, path)
+        profiler.dump_stats(os.path.join(directory, name))
+
+
+class ReplicaMiddleware(object):
+    '''
+    Serves the reads of safe-method requests from a read replica, see
+    config/routers.py. Responses to other methods pin the client to the
+    primary for REPLICAS['PIN_SECONDS'] with a cookie holding the pin's
+    expiry, and by user id for authenticated clients. Removed from the
+    middleware chain unless REPLICAS['ALIASES'] is set.
+    '''
+
+    def __init__(self, get_response):
+        self.options = routers.options()
+        if not self.options['ALIASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            expires = time.time() + self.options['PIN_SECONDS']
+            response.set_cookie(self.options['PIN_COOKIE'], '%d' % expires,
+                                max_age=self.options['PIN_SECONDS'], httponly=True)
+            routers.pin(getattr(request, 'user', None))
+            return response
+        if self.pinned(request):
+            return self.get_response(request)
+        with routers.reading_from_replica():
+            response = self.get_response(request)
+            alias = routers.current_replica()  # None if the view pinned the primary
+        if response.streaming and alias:
+            response.streaming_content = self.stream(response.streaming_content, alias)
+        return response
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.options['PIN_COOKIE'], 0)) > time.time()
+        except ValueError:
+            return False
+
+    def stream(self, content, alias):
+        ''' Keep reading from `alias` while the response is consumed,
+            without leaving the routing in place between chunks. '''
+        content = iter(content)
+        while True:
+            with routers.reading_from_replica(alias):
+                chunk = next(content, None)
+            if chunk is None:
+                return
+            yield chunk
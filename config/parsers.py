@@ -0,0 +1,41 @@
+''' JSON parser decoding with orjson when it is installed and with a
+    preconfigured stdlib decoder otherwise. '''
+import json
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+from config.renderers import orjson
+
+
+def _reject_constant(name):
+    raise ValueError('Out of range float values are not JSON compliant')
+
+
+_stdlib_decoder = json.JSONDecoder(
+    parse_constant=_reject_constant if api_settings.STRICT_JSON else None)
+
+
+def loads_stdlib(body, encoding='utf-8'):
+    return _stdlib_decoder.decode(body.decode(encoding))
+
+
+def loads_orjson(body, encoding='utf-8'):
+    if encoding.lower().replace('-', '') != 'utf8':
+        return loads_stdlib(body, encoding)
+    return orjson.loads(body)  # rejects NaN and Infinity like STRICT_JSON
+
+
+loads = loads_orjson if orjson is not None and api_settings.STRICT_JSON else loads_stdlib
+
+
+class JSONParser(parsers.JSONParser):
+    ''' Drop-in for rest_framework's JSONParser. '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return loads(stream.read(), encoding)
+        except ValueError as exc:  # includes decoding errors
+            raise ParseError('JSON parse error - %s' % exc)
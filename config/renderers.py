@@ -0,0 +1,82 @@
+''' JSON renderer encoding with orjson when it is installed and with a
+    preconfigured stdlib encoder otherwise. Compact output is byte for byte
+    what rest_framework's JSONRenderer produces: UTF-8, no spaces, U+2028
+    and U+2029 escaped, UUIDs and datetimes formatted by the same rules.
+    Except for floats with orjson, which
+    - writes those Python writes in exponent notation, under 1e-4 or from
+      1e16, its own way: 1e16, 1e-7 and 0.00001 for 1e+16, 1e-07 and 1e-05,
+    - writes NaN and infinities as null, where rest_framework raises.
+    The floats of this API, search scores rounded to 4 places, are neither. '''
+import datetime
+import json
+import uuid
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def _datetime(value):
+    representation = value.isoformat()
+    if representation.endswith('+00:00'):
+        representation = representation[:-6] + 'Z'
+    return representation
+
+
+# exact type -> conversion, looked up before rest_framework's isinstance chain
+CONVERTERS = {
+    uuid.UUID: str,
+    datetime.datetime: _datetime,
+    datetime.date: datetime.date.isoformat,
+}
+
+
+def default(obj):
+    ''' JSON value of an object the encoder does not know. '''
+    convert = CONVERTERS.get(type(obj))
+    if convert is not None:
+        return convert(obj)
+    return _encoder.default(obj)
+
+
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False,
+                                   separators=(',', ':'), default=default)
+
+
+def dumps_stdlib(data):
+    ret = _stdlib_encoder.encode(data)
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+def dumps_orjson(data):
+    try:
+        # orjson formats datetimes itself unless told to pass them through
+        ret = orjson.dumps(data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    except TypeError:  # non-str keys, integers over 64 bits
+        return dumps_stdlib(data)
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+dumps = dumps_orjson if orjson is not None else dumps_stdlib
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    ''' Drop-in for rest_framework's JSONRenderer. Indented output and
+        non-default UNICODE_JSON, COMPACT_JSON or STRICT_JSON settings go
+        through the original. '''
+    fast = not renderers.JSONRenderer.ensure_ascii and renderers.JSONRenderer.compact \
+        and renderers.JSONRenderer.strict
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        if not self.fast or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
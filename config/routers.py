@@ -0,0 +1,87 @@
+''' Primary/replica database routing.
+    Writes always go to the primary ('default'). Reads go to one of
+    REPLICAS['ALIASES'] only inside reading_from_replica(), which
+    ReplicaMiddleware enters for safe-method requests, so reads made while
+    handling a write, by management commands or by tests stay on the
+    primary. A client that wrote is pinned to the primary for
+    REPLICAS['PIN_SECONDS'], long enough for the replicas to catch up, so it
+    reads its own writes: by cookie, and by user id for clients that do not
+    keep cookies. '''
+import random
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    'ALIASES': [],  # DATABASES aliases serving reads, none to read from the primary
+    'PIN_SECONDS': 5,  # reads stay on the primary this long after a client writes
+    'PIN_COOKIE': 'pin_primary',
+    'CACHE': 'default',  # cache alias sharing user pins between processes
+}
+
+PRIMARY = 'default'
+
+_local = threading.local()
+
+
+def options():
+    return dict(DEFAULTS, **getattr(settings, 'REPLICAS', {}))
+
+
+@contextmanager
+def reading_from_replica(alias=None):
+    ''' Route the reads of the block to replica `alias`, a random one of
+        REPLICAS['ALIASES'] by default. Reads stay on the primary when there
+        are no replicas. '''
+    aliases = options()['ALIASES']
+    previous = getattr(_local, 'replica', None)
+    _local.replica = alias or (random.choice(aliases) if aliases else None)
+    try:
+        yield
+    finally:
+        _local.replica = previous
+
+
+def current_replica():
+    ''' The replica reads are routed to, None for the primary. '''
+    return getattr(_local, 'replica', None)
+
+
+def use_primary():
+    ''' Send the remaining reads of the current block to the primary. '''
+    _local.replica = None
+
+
+def user_pin_key(user_id):
+    return 'replicas:pin:%s' % user_id
+
+
+def pin(user=None):
+    ''' Pin `user` to the primary after a write. '''
+    if user is not None and user.is_authenticated:
+        opts = options()
+        caches[opts['CACHE']].set(user_pin_key(user.pk), True, opts['PIN_SECONDS'])
+
+
+def is_pinned(user):
+    ''' Whether `user` wrote within the last REPLICAS['PIN_SECONDS']. '''
+    if not current_replica() or user is None or not user.is_authenticated:
+        return False
+    return bool(caches[options()['CACHE']].get(user_pin_key(user.pk)))
+
+
+class ReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        return current_replica() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        ''' Replicas hold the same rows as the primary. '''
+        databases = {PRIMARY}.union(options()['ALIASES'])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
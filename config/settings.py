@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+from config import sqlite
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.middleware.InstrumentationMiddleware',
+    'config.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,6 +57,13 @@ MIDDLEWARE = [
 
 LOGIN_REDIRECT_URL = '/articles/'
 
+# Server-Timing header and sampled cProfile dumps, see config/middleware.py
+INSTRUMENTATION = {
+    'ENABLED': False,
+    'PROFILE_SAMPLE_RATE': 0.0,  # fraction of requests profiled
+    'PROFILE_DIR': os.path.join(BASE_DIR, 'profiles'),
+}
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -77,26 +87,91 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'config.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
+    # orjson when installed, see config/renderers.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'config.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'config.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
 
+ARTICLES = {
+    'CACHE': 'articles',  # cache alias for serialized article payloads, None to disable
+}
+
 JWT_AUTH = {
     'JWT_ALLOW_REFRESH': True,
 }
 
+JWT_AUTH_CACHE = {
+    'TTL': 30,  # seconds
+    'MAX_ENTRIES': 10000,
+}
+
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+# SQLite connection profile, 'tuned' or 'default', see config/sqlite/__init__.py
+SQLITE_PROFILE = os.environ.get('DJANGO_SQLITE_PROFILE', 'tuned')
+
 DATABASES = {
+    'default': sqlite.database(
+        os.path.join(BASE_DIR, 'db.sqlite3'), SQLITE_PROFILE,
+        # file backed so that tests can exercise concurrent connections,
+        # in-memory shared cache databases fail instead of waiting on locks
+        TEST={'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
+    ),
+}
+
+# Read replicas, see config/routers.py. 'replica' is a second SQLite file
+# standing in for a replica locally; keep it in sync with the primary
+# (e.g. migrate --database=replica, then copy db.sqlite3 over it) and enable
+# it with DJANGO_DB_REPLICAS=replica.
+DATABASES['replica'] = sqlite.database(
+    os.path.join(BASE_DIR, 'db_replica.sqlite3'), SQLITE_PROFILE,
+    TEST={'MIRROR': 'default'},
+)
+
+# Article shards, see articles/shards.py. DJANGO_DB_SHARDS=shard1,shard2
+# adds a db_<alias>.sqlite3 file per alias, create their tables with
+# migrate --database=<alias> and move existing articles with rebalance_shards.
+ARTICLES['SHARDS'] = [alias for alias in os.environ.get('DJANGO_DB_SHARDS', '').split(',') if alias]
+for alias in ARTICLES['SHARDS']:
+    DATABASES.setdefault(alias, sqlite.database(
+        os.path.join(BASE_DIR, 'db_%s.sqlite3' % alias), SQLITE_PROFILE,
+        TEST={'NAME': os.path.join(BASE_DIR, 'test_db_%s.sqlite3' % alias)},
+    ))
+
+DATABASE_ROUTERS = ['articles.shards.ShardRouter', 'config.routers.ReplicaRouter']
+
+REPLICAS = {
+    'ALIASES': [alias for alias in os.environ.get('DJANGO_DB_REPLICAS', '').split(',') if alias],
+    'PIN_SECONDS': 5,  # reads stay on the primary this long after a client writes
+}
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'articles': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'articles',
+        'TIMEOUT': 300,  # seconds
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
 }
 
 
@@ -0,0 +1,60 @@
+import random
+import time
+from django.db.backends.sqlite3 import base
+from django.db.backends.sqlite3.base import Database
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    ''' sqlite3 backend applying pragmas to new connections, taking the
+        write lock when a transaction starts and retrying locked statements. '''
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # not sqlite3.connect() arguments
+        self.pragmas = kwargs.pop('pragmas', {})
+        self.lock_retries = kwargs.pop('lock_retries', 0)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value)).fetchall()
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=RetryingCursorWrapper)
+        cursor.retries = self.lock_retries
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        # a deferred transaction that reads and then writes fails right
+        # away with "database is locked" when another writer got there
+        # first; asking for the write lock upfront waits for it instead
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+
+class RetryingCursorWrapper(base.SQLiteCursorWrapper):
+    ''' Retries statements failing on a locked database with exponential
+        backoff. Only statements that start or run outside a transaction
+        are retried, a locked statement inside one is left to the caller. '''
+    retries = 0
+    backoff = 0.01  # seconds, doubled on every attempt
+
+    def execute(self, query, params=None):
+        return self.retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self.retry(super().executemany, query, param_list)
+
+    def retry(self, execute, *args):
+        attempt = 0
+        while True:
+            in_transaction = self.connection.in_transaction
+            try:
+                return execute(*args)
+            except Database.OperationalError as e:
+                if (in_transaction or attempt >= self.retries
+                        or 'locked' not in str(e)):
+                    raise
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
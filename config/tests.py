@@ -3,7 +3,22 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework_jwt.views import obtain_jwt_token, verify_jwt_token, refresh_jwt_token
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
+import os
+import tempfile
+import uuid
+from collections import OrderedDict
+from unittest import skipUnless
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import renderers
+from django.core.exceptions import ImproperlyConfigured
+from config import routers, sqlite
+from config.authentication import token_cache
+from config.renderers import JSONRenderer, dumps_orjson, dumps_stdlib, orjson
 
 class JWTViewsSetTest(APITestCase):
     def setUp(self):
@@ -67,3 +82,271 @@ class JWTViewsSetTest(APITestCase):
 
     def tearDown(self):
         self.user.delete()
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        token_cache.clear()
+        resp = self.client.post(reverse(obtain_jwt_token), {'username':'testuser', 'password':'pass'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + resp.data['token'])
+
+    def test_cached_user(self):
+        '''
+        Test repeated requests with the same JWT token
+        Should resolve the user from the cache without a query
+        '''
+        with CaptureQueriesContext(connection) as first:
+            resp = self.client.get('/articles/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as second:
+            resp = self.client.get('/articles/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse(any('auth_user' in q['sql'] for q in second))
+
+    def test_deactivated_user(self):
+        '''
+        Test a cached JWT token of a deactivated user
+        Should be rejected right away
+        '''
+        self.assertEqual(self.client.get('/articles/').status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/articles/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user(self):
+        '''
+        Test a cached JWT token of a deleted user
+        Should be rejected right away
+        '''
+        self.assertEqual(self.client.get('/articles/').status_code, status.HTTP_200_OK)
+        self.user.delete()
+        self.assertEqual(self.client.get('/articles/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_bounded(self):
+        '''
+        Test the token cache size bound
+        Should evict the least recently used tokens
+        '''
+        old_max = token_cache.max_entries
+        token_cache.max_entries = 2
+        try:
+            for token in ('a', 'b', 'c'):
+                token_cache.set(token, self.user)
+            self.assertIsNone(token_cache.get('a'))
+            self.assertEqual(token_cache.get('c'), self.user)
+        finally:
+            token_cache.max_entries = old_max
+
+    def test_settings(self):
+        '''
+        Test JWT_AUTH_CACHE overridden after startup
+        Should bound the cache by the current settings
+        '''
+        with override_settings(JWT_AUTH_CACHE={'MAX_ENTRIES': 1, 'TTL': 0}):
+            token_cache.set('a', self.user)
+            self.assertIsNone(token_cache.get('a'))  # expired
+        with override_settings(JWT_AUTH_CACHE={'MAX_ENTRIES': 1}):
+            token_cache.set('a', self.user)
+            token_cache.set('b', self.user)
+            self.assertIsNone(token_cache.get('a'))
+            self.assertEqual(token_cache.get('b'), self.user)
+
+    def test_copies(self):
+        '''
+        Test cached users handed to several requests
+        Should be separate instances, changes to one invisible to the others
+        '''
+        token_cache.set('a', self.user)
+        self.user.first_name = 'changed'
+        first, second = token_cache.get('a'), token_cache.get('a')
+        self.assertIsNot(first, second)
+        first.is_active = False
+        self.assertEqual((second.first_name, second.is_active), ('', True))
+
+
+class CachedJWTEvictionTest(APITransactionTestCase):
+    def test_evicted_on_commit(self):
+        '''
+        Test a user cached again by a concurrent request before a deactivation commits
+        Should be evicted once it commits
+        '''
+        user = User.objects.create_user(username='testuser', password='pass')
+        token_cache.clear()
+        with transaction.atomic():
+            stale = User.objects.get(pk=user.pk)
+            user.is_active = False
+            user.save()
+            token_cache.set('token', stale)
+            self.assertIsNotNone(token_cache.get('token'))
+        self.assertIsNone(token_cache.get('token'))
+
+
+class InstrumentationMiddlewareTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+
+    def test_disabled(self):
+        '''
+        Test a request with instrumentation disabled
+        Should not send a Server-Timing header
+        '''
+        resp = self.client.get('/articles/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(resp.has_header('Server-Timing'))
+
+    def test_server_timing(self):
+        '''
+        Test a request with instrumentation enabled
+        Should report db, auth, serializer, view and render time and dump a sampled profile
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            options = {'ENABLED': True, 'PROFILE_SAMPLE_RATE': 1.0, 'PROFILE_DIR': directory}
+            with override_settings(INSTRUMENTATION=options):
+                resp = self.client.get('/articles/')
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            metrics = dict(m.split(';', 1) for m in resp['Server-Timing'].split(', '))
+            self.assertEqual(set(metrics), {'db', 'auth', 'serialize', 'view', 'render', 'total'})
+            self.assertIn('queries', metrics['db'])
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+
+class SQLiteProfileTest(APITestCase):
+    def test_tuned_profile(self):
+        '''
+        Test connections of the tuned SQLite profile
+        Should apply the profile pragmas
+        '''
+        if connection.settings_dict['ENGINE'] != 'config.sqlite':
+            self.skipTest('tuned profile not in use')
+        with connection.cursor() as cursor:
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+                cursor.execute('PRAGMA %s' % name)
+                value = cursor.fetchone()[0]
+                expected = {'synchronous': 1}.get(name, sqlite.PRAGMAS[name])  # NORMAL
+                self.assertEqual(value, expected, name)
+
+    def test_unknown_profile(self):
+        '''
+        Test sqlite.database() with an unknown profile
+        Should raise ImproperlyConfigured
+        '''
+        with self.assertRaises(ImproperlyConfigured):
+            sqlite.database('db.sqlite3', 'fast')
+
+
+class JSONRendererParserTest(APITestCase):
+    def test_render_matches_rest_framework(self):
+        '''
+        Test config.renderers.JSONRenderer against rest_framework's
+        Should render the same bytes, indented output included
+        '''
+        now = timezone.now()
+        data = [OrderedDict([('id', uuid.uuid4()), ('date', now), ('day', now.date()),
+                             ('naive', now.replace(tzinfo=None)), ('num', 2 ** 70),
+                             ('text', 'caf\xe9 \u2028 \u2029 "\u2603"'), ('score', 0.1234),
+                             ('none', None), ('list', (1, 2)), ('map', {1: 'one'})])]
+        for accepted in (None, 'application/json; indent=4'):
+            self.assertEqual(JSONRenderer().render(data, accepted),
+                             renderers.JSONRenderer().render(data, accepted))
+        self.assertEqual(dumps_stdlib(data), renderers.JSONRenderer().render(data))
+
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_orjson_floats(self):
+        '''
+        Test dumps_orjson against rest_framework's JSONRenderer
+        Should render the same bytes but for the floats documented in config/renderers.py
+        '''
+        now = timezone.now()
+        render = renderers.JSONRenderer().render
+        for value in (now, now.replace(tzinfo=None), now.date(), uuid.uuid4(),
+                      0.1234, 0.0001, 2.5, -0.0, 1e15):
+            self.assertEqual(dumps_orjson([value]), render([value]), value)
+        floats = [1e16, 1e-7, 1e-5]
+        self.assertEqual(dumps_orjson(floats), b'[1e16,1e-7,0.00001]')
+        self.assertEqual(render(floats), b'[1e+16,1e-07,1e-05]')
+        self.assertEqual(dumps_orjson([float('nan'), float('inf')]), b'[null,null]')
+        with self.assertRaises(ValueError):
+            render([float('nan')])
+
+    def test_parse_errors(self):
+        '''
+        Test POST /articles/ with malformed and non-compliant JSON bodies
+        Should return 400 Bad Request
+        '''
+        self.client.force_authenticate(User.objects.create_user(username='testuser'))
+        url = reverse('articles-list')
+        for body in ('{"title": ', '{"title": NaN}', b'{"title": "\xff"}'):
+            resp = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(url, '{"title": "caf\xe9"}', content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.data['title'], 'caf\xe9')
+
+
+@override_settings(REPLICAS={'ALIASES': ['replica'], 'PIN_SECONDS': 5})
+class ReplicaRoutingTest(APITransactionTestCase):
+    # committed rows, the replica stand-in is a second connection to the test database
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='pass')
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def queries(self, method, url, data=None):
+        ''' Response and number of queries on the primary and the replica. '''
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            resp = getattr(self.client, method)(url, data)
+            if resp.streaming:
+                b''.join(resp.streaming_content)
+        return resp, len(primary), len(replica)
+
+    def test_reads_from_replica(self):
+        '''
+        Test GET requests with a replica configured
+        Should read from the replica only, streamed responses included
+        '''
+        resp = self.client.post(reverse('articles-list'), {'title': 'a', 'sentences': ['one']})
+        article = resp.data['id']
+        self.client.cookies.clear()
+        cache.clear()
+        for url in (reverse('articles-list'), reverse('articles-detail', args=[article]),
+                    reverse('articles-export', args=[article])):
+            resp, primary, replica = self.queries('get', url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(primary, 0, url)
+            self.assertGreater(replica, 0, url)
+
+    def test_read_your_writes(self):
+        '''
+        Test GET requests right after the same client wrote
+        Should read from the primary, pinned by cookie and by user
+        '''
+        resp, primary, replica = self.queries('post', reverse('articles-list'), {'title': 'a'})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replica, 0)
+        self.assertIn('pin_primary', resp.cookies)
+        url = reverse('articles-detail', args=[resp.data['id']])
+        resp, primary, replica = self.queries('get', url)
+        self.assertEqual((resp.status_code, replica), (status.HTTP_200_OK, 0))
+        self.client.cookies.clear()  # e.g. a token client without a cookie jar
+        resp, primary, replica = self.queries('get', url)
+        self.assertEqual((resp.status_code, replica), (status.HTTP_200_OK, 0))
+        cache.clear()  # pin expired
+        resp, primary, replica = self.queries('get', url)
+        self.assertEqual((resp.status_code, primary), (status.HTTP_200_OK, 0))
+
+    def test_router(self):
+        '''
+        Test the router outside of requests
+        Should read from the primary unless a replica is selected, always write to the primary
+        '''
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_read(User), 'default')
+        with routers.reading_from_replica():
+            self.assertEqual(router.db_for_read(User), 'replica')
+            self.assertEqual(router.db_for_write(User), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
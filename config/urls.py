@@ -27,5 +27,6 @@ urlpatterns = [
     url(r'^auth/refresh', refresh_jwt_token),
     url(r'^auth/verify', verify_jwt_token),
     url(r'^admin/', admin.site.urls),
+    url(r'^sync/$', views.SyncView.as_view(), name='sync'),
     url(r'^', include(router.urls)),
 ]